@@ -6,29 +6,119 @@ Arquivo: https_demo_server_final.py
 Instruções rápidas:
 - Salve este arquivo e execute com Python 3.8+:
     python https_demo_server_final.py
+  Opções:
+    --engine asyncio         atende todas as conexões em um único event loop (padrão: threading)
+    --max-connections N      limite de conexões simultâneas por porta no motor asyncio
+    --engine pool            número fixo de threads por porta (--pool-size) e fila limitada
+                             de conexões (--pool-queue); fila cheia => 503 com Retry-After
+    --workers N              N processos (fork) nas mesmas portas via SO_REUSEPORT, com um
+                             supervisor que recria workers mortos; combina com qualquer --engine
+    --fsync none|batch|interval  política de fsync do collected.jsonl (gravado em lotes por
+                                 uma única thread; veja WRITER_*)
+    --compress none|gzip|zstd    compressão dos segmentos de collected.jsonl; o arquivo é
+                                 rotacionado por tamanho/hora para `collected_data/segments/`
+                                 (veja ROTATE_* e segments/manifest.json)
+- Todos os motores falam HTTP/1.1 com conexões persistentes (veja KEEPALIVE_TIMEOUT e
+  KEEPALIVE_MAX_REQUESTS), evitando um novo handshake TLS a cada POST em /collect.
 
-- O servidor tentará gerar um certificado autofirmado (requer pacote `cryptography`).
+- O servidor tentará gerar um certificado autofirmado (requer pacote `cryptography`), em
+  segundo plano: o HTTP já atende enquanto a chave é gerada e o HTTPS sobe em seguida.
   Se não quiser instalar, abra em HTTP: http://127.0.0.1:8000
 - Página principal: https://127.0.0.1:8443  (ou http://127.0.0.1:8000 se HTTPS não iniciado)
+- `--cert-key ecdsa` gera o certificado com ECDSA P-256 (handshake mais rápido que RSA-2048).
+  Handshakes completos vs. retomados aparecem em http://127.0.0.1:8000/_status (só no loopback).
+- Métricas no formato do Prometheus em http://127.0.0.1:8000/metrics (só no loopback, veja
+  METRICS_PUBLIC): requisições e latência por rota (e por payload.type em /collect), bytes,
+  conexões abertas, fila do writer, handshakes TLS. Com --workers, cada processo tem as suas.
+- Perfil sob demanda (amostragem de todas as threads, arquivo .folded em collected_data/profiles/,
+  abre no speedscope): curl -X POST 'http://127.0.0.1:8000/_profile?seconds=30' (só no loopback)
+  ou kill -USR1 <pid> (liga/desliga; com --workers, use o pid do worker).
+- Com `orjson` (ou `msgspec`) instalado, /collect usa esse codec JSON; sem eles, a biblioteca
+  padrão. Corpos que não precisam de ajuste vão para o log exatamente como chegaram.
+- Log de acesso: --access-log-format text|json|off, --access-log ARQUIVO (padrão: stderr) e
+  --access-log-sample '/static/=0.1' (erros são sempre registrados). É gravado em lote por uma
+  thread; o benchmark roda com ele desligado.
 
 AVISO IMPORTANTE:
 Este código serve uma página que pede permissões (localização, câmera, microfone) e salva
-os dados localmente em `collected_data/collected.jsonl`.
+os dados localmente em `collected_data/collected.jsonl` (strings muito grandes, como o snapshot
+da câmera, vão para arquivos em `collected_data/uploads/` referenciados no registro).
+Snapshots (`image_base64`) são decodificados e guardados uma única vez em `collected_data/blobs/`,
+pelo hash SHA-256; o registro guarda só `image_blob` (hash, tamanho e tipo). Para apagar blobs
+sem registro:  python https_demo_server_final.py gc-blobs
+Consulta indexada (por tempo, IP e tipo):
+    python https_demo_server_final.py query --type location --since 2025-10-01T00:00
+Benchmark (servidor no loopback, relatório JSON comparável entre execuções):
+    python https_demo_server_final.py bench --output antes.json
+    python https_demo_server_final.py bench --compare antes.json
+Partida a frio (do exec à primeira resposta HTTP/HTTPS; código 1 se passar de STARTUP_TARGET
+ou se importar o módulo carregar algum de STARTUP_LAZY_MODULES):
+    python https_demo_server_final.py startup-time --runs 5
 Use apenas em ambiente local e com seu próprio consentimento. Não use para coletar dados de
 outras pessoas sem permissão.
 """
 
-from decouple import config
+import argparse
+import base64
+import binascii
+import bisect
+import contextlib
+import email.utils
+import fcntl
+import html
+import http.client
 import http.server
+import io
+import itertools
+import socket
 import socketserver
+import stat
+import struct
+import tempfile
 import ssl
 import threading
 import json
+import mimetypes
+import os
+import queue
+import random
+import re
+import resource
+import secrets
+import select
+import shutil
+import signal
+import collections
 import datetime
+import gzip
+import hashlib
 import sys
+import time
+import urllib.parse
+import zlib
 from pathlib import Path
 from http import HTTPStatus
 
+try:
+    import brotli  # opcional: variante 'br' da página principal
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard  # opcional: compressão zstd dos segmentos do log
+except ImportError:
+    zstandard = None
+
+try:
+    import orjson  # opcional: codec JSON rápido para /collect
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec  # opcional: alternativa ao orjson
+except ImportError:
+    msgspec = None
+
 # Configurações
 HOST = '0.0.0.0'
 HTTP_PORT = 8000
@@ -37,6 +127,108 @@ LOG_DIR = Path('collected_data')
 LOG_DIR.mkdir(exist_ok=True)
 CERT_FILE = Path('cert.pem')
 KEY_FILE = Path('key.pem')
+# TLS (build_ssl_context)
+TLS_KEY_TYPE = 'rsa'                # tipo da chave gerada quando não há cert.pem: 'rsa' | 'ecdsa'
+TLS_CIPHERS = 'ECDHE+AESGCM:ECDHE+CHACHA20'     # TLS 1.2; as suítes do TLS 1.3 são as padrão
+TLS_SESSION_TICKETS = 2             # tickets emitidos por handshake completo (TLS 1.3)
+TLS_HANDSHAKE_TIMEOUT = 10          # segundos para o cliente concluir o handshake
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')
+# Log de acesso (AccessLog): uma thread grava em lote o que os handlers enfileiram
+ACCESS_LOG_FORMAT = 'text'          # 'text' (mesmo formato do http.server) | 'json' | 'off'
+ACCESS_LOG_FILE = None              # None: stderr
+ACCESS_LOG_SAMPLE = {}              # rota -> fração registrada, ex. {'/static/': 0.1}; status >= 400 sempre
+ACCESS_LOG_FLUSH_INTERVAL = 0.2     # segundos entre gravações
+ACCESS_LOG_QUEUE_SIZE = 100000      # entradas pendentes; acima disso as mais antigas são descartadas
+# Métricas (/metrics, formato texto do Prometheus; valores por processo)
+METRICS_PUBLIC = False              # False: /metrics só responde ao loopback
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_MAX_PAYLOAD_TYPES = 32      # valores distintos de payload.type; os demais viram 'other'
+LISTEN_BACKLOG = 1024              # fila de conexões do kernel (listen) em todos os motores
+# Motor asyncio (--engine asyncio)
+ASYNC_MAX_CONNECTIONS = 1000
+# Motor com pool de threads (--engine pool)
+POOL_WORKERS = 32               # threads fixas por porta
+POOL_QUEUE_SIZE = 128           # conexões aceitas esperando uma thread livre
+POOL_RETRY_AFTER = 2            # segundos sugeridos no 503 quando a fila está cheia
+POOL_IDLE_TIMEOUT = 5           # conexão ociosa segura uma thread do pool por no máximo N segundos
+# Parada e reinício (Lifecycle)
+SHUTDOWN_DRAIN_TIMEOUT = 20     # segundos para as requisições em andamento terminarem ao parar
+SHUTDOWN_IDLE_GRACE = 1.0       # conexão keep-alive ociosa há mais que isso é fechada na parada; as
+                                # mais ativas recebem 'Connection: close' na próxima resposta
+HANDOFF_READY_TIMEOUT = 30      # no reinício (SIGHUP), espera até o novo processo estar atendendo
+LISTEN_FDS_ENV = 'DEMO_LISTEN_FDS'  # sockets de escuta herdados pelo novo processo ('http=5,https=6')
+READY_FD_ENV = 'DEMO_READY_FD'      # pipe em que o novo processo avisa que está pronto
+# Vários processos (--workers N)
+PREFORK_STOP_TIMEOUT = 30       # segundos para cada worker parar antes do SIGKILL
+PREFORK_RESPAWN_DELAY = 1.0     # espera antes de recriar um worker que morreu logo ao iniciar
+# Conexões persistentes (HTTP/1.1 keep-alive)
+KEEPALIVE_TIMEOUT = 15          # segundos ociosos antes de fechar a conexão
+KEEPALIVE_MAX_REQUESTS = 100    # requisições atendidas por conexão antes de fechá-la
+# Proteção contra clientes abusivos ou quebrados (todos os motores)
+RATE_LIMIT_RPS = 20.0           # requisições/s por IP (token bucket); 0 desliga
+RATE_LIMIT_BURST = 60           # rajada máxima por IP
+RATE_LIMIT_MAX_CLIENTS = 10000  # IPs acompanhados; o menos recente sai quando enche
+RATE_LIMIT_EXEMPT = LOOPBACK_ADDRESSES  # o bench e o /_status vêm do loopback
+HEADER_TIMEOUT = 10             # segundos do primeiro byte da requisição ao fim dos cabeçalhos
+MAX_HEADER_SIZE = 16 * 1024     # linha de requisição + cabeçalhos
+BODY_TIMEOUT = 30               # prazo do corpo: BODY_TIMEOUT + tamanho / BODY_MIN_RATE segundos
+BODY_MIN_RATE = 16 * 1024       # bytes/s
+# Gravação em lote de collected.jsonl (RecordWriter)
+WRITER_BATCH_SIZE = 256         # registros por lote
+WRITER_FLUSH_INTERVAL = 0.05    # segundos que um registro pode esperar até o lote ser gravado
+WRITER_FSYNC = 'none'           # 'none' | 'batch' | 'interval'
+WRITER_FSYNC_INTERVAL = 1.0     # segundos entre fsyncs na política 'interval'
+WRITER_QUEUE_SIZE = 10000       # registros aguardando gravação antes de recusar com 503
+WRITER_SUBMIT_TIMEOUT = 2.0     # segundos que o handler espera por espaço na fila
+# Arquivos estáticos (/static/)
+STATIC_DIR = Path('static')
+STATIC_CACHE_MAX_BYTES = 16 * 1024 * 1024   # memória total do cache LRU de arquivos pequenos
+STATIC_CACHE_MAX_FILE = 256 * 1024          # arquivos maiores são enviados direto do disco
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'  # CSS/JS da página (nome leva o hash)
+# Corpo das requisições POST /collect
+MAX_BODY_SIZE = 32 * 1024 * 1024        # acima disso responde 413 sem ler o corpo
+MAX_DECODED_BODY_SIZE = 64 * 1024 * 1024  # corpo com Content-Encoding: limite depois de descomprimir
+BATCH_MAX_EVENTS = 100                  # eventos aceitos por POST em /collect/batch
+BODY_CHUNK_SIZE = 64 * 1024             # tamanho dos blocos lidos do socket
+ASYNC_BODY_MEMORY = 256 * 1024          # motor asyncio: corpo até N bytes fica na memória; o resto
+                                        # vai para um arquivo temporário enquanto chega
+SPOOL_FIELD_THRESHOLD = 256 * 1024      # strings JSON maiores vão para o disco durante o parsing
+UPLOADS_DIR = LOG_DIR / 'uploads'
+# Snapshots decodificados, endereçados pelo SHA-256 (veja o comando gc-blobs)
+BLOB_DIR = LOG_DIR / 'blobs'
+BLOB_GC_MIN_AGE = 3600      # segundos; blobs mais novos nunca são apagados pelo gc
+# Rotação de collected.jsonl em segmentos (LogSegments)
+SEGMENT_DIR = LOG_DIR / 'segments'
+ROTATE_MAX_BYTES = 64 * 1024 * 1024     # fecha o segmento ao passar deste tamanho (0 = sem limite)
+ROTATE_INTERVAL = 3600                  # e a cada hora (0 = sem rotação por tempo)
+ROTATE_COMPRESSION = 'gzip'             # 'none' | 'gzip' | 'zstd' (requer o pacote zstandard)
+INDEX_FILE = LOG_DIR / 'index.sqlite3'  # índice usado pelo comando query
+COMPACT_DIR = LOG_DIR / 'compact'       # segmentos no formato compacto (comando compact)
+COMPACT_BLOCK_RECORDS = 4096            # registros por bloco do formato compacto
+COMPACT_INTERN_MAX = 64                 # strings até N caracteres entram no dicionário
+BENCH_SNAPSHOT_BYTES = 256 * 1024       # imagem do snapshot usada pelo comando bench
+STARTUP_TARGET = 1.0                    # segundos do exec à primeira resposta HTTP (comando startup-time)
+# módulos que só motores/subcomandos específicos usam: startup-time falha se `import` os carregar
+STARTUP_LAZY_MODULES = ('asyncio', 'sqlite3', 'multiprocessing', 'subprocess', 'decouple', 'cryptography')
+# Perfil sob demanda (POST /_profile no loopback ou SIGUSR1); nada roda enquanto desligado
+PROFILE_DIR = LOG_DIR / 'profiles'
+PROFILE_SECONDS = 30            # janela padrão da captura
+PROFILE_MAX_SECONDS = 600
+PROFILE_INTERVAL = 0.005        # segundos entre amostras das pilhas de todas as threads
+
+def setting(name, default=''):
+    """Valor de uma configuração: variável de ambiente ou, se não houver, o .env (via decouple).
+
+    O decouple só é importado quando a variável não está no ambiente; sem ele, vale `default`.
+    """
+    value = os.environ.get(name)
+    if value is not None:
+        return value
+    try:
+        from decouple import config
+    except ImportError:
+        return default
+    return config(name, default=default)
 
 # HTML (mantive o visual e conteúdo conforme solicitado; JS inclui coleta aprimorada)
 # === ATENÇÃO: substitua 'REPLACE_WITH_YOUR_KEY' pela sua chave real do Google Maps API ===
@@ -195,10 +387,10 @@ HTML_CONTENT = (r'''<!DOCTYPE html>
         </div>
     </div>''' +
 
-    f'''
+    '''
     <script>
         // --- coloque sua chave aqui (substitua o valor abaixo) ---
-        const GOOGLE_MAPS_API_KEY = '{config("SECRET_KEY", cast=str)}';
+        const GOOGLE_MAPS_API_KEY = '__GOOGLE_MAPS_API_KEY__';
         // ---------------------------------------------------------''' +
     
         r'''// Variáveis
@@ -211,20 +403,64 @@ HTML_CONTENT = (r'''<!DOCTYPE html>
         let marker = null;
         let currentLocation = null;
 
-        // Helper: envia JSON para /collect
-        async function postToServer(payload) {
+        // Eventos vão para uma fila e saem juntos em /collect/batch: BATCH_DELAY_MS após o
+        // primeiro da fila, ou na hora em que a aba fica oculta (sendBeacon sobrevive ao fechamento)
+        const BATCH_DELAY_MS = 1000;
+        const BATCH_MAX_EVENTS = 100;
+        let pendingEvents = [];
+        let flushTimer = null;
+
+        function postToServer(payload) {
+            pendingEvents.push(payload);
+            if (pendingEvents.length >= BATCH_MAX_EVENTS) flushEvents();
+            else if (!flushTimer) flushTimer = setTimeout(flushEvents, BATCH_DELAY_MS);
+        }
+
+        function flushEvents(useBeacon) {
+            const beacon = useBeacon === true;
+            if (flushTimer) { clearTimeout(flushTimer); flushTimer = null; }
+            while (pendingEvents.length) {
+                const body = JSON.stringify(pendingEvents.splice(0, BATCH_MAX_EVENTS));
+                // sendBeacon recusa corpos grandes (~64 KB, ex.: com snapshot): aí vai por fetch
+                if (beacon && navigator.sendBeacon &&
+                    navigator.sendBeacon('/collect/batch', new Blob([body], { type: 'application/json' }))) continue;
+                sendBatch(body, beacon && body.length < 65536);
+            }
+        }
+
+        // Lotes maiores que isso vão com gzip (CompressionStream), quando o navegador suporta
+        const COMPRESS_MIN_BYTES = 1024;
+
+        async function gzipBody(body) {
+            const stream = new Blob([body]).stream().pipeThrough(new CompressionStream('gzip'));
+            return await new Response(stream).arrayBuffer();
+        }
+
+        async function sendBatch(body, keepalive) {
             try {
-                const resp = await fetch('/collect', {
+                const headers = { 'Content-Type': 'application/json' };
+                // keepalive (aba fechando) não espera a compressão
+                if (!keepalive && window.CompressionStream && body.length >= COMPRESS_MIN_BYTES) {
+                    body = await gzipBody(body);
+                    headers['Content-Encoding'] = 'gzip';
+                }
+                const resp = await fetch('/collect/batch', {
                     method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify(payload)
+                    headers: headers,
+                    body: body,
+                    keepalive: keepalive
                 });
                 if (!resp.ok) console.warn('Falha ao enviar:', resp.status, resp.statusText);
             } catch (e) {
-                console.warn('Erro ao enviar para /collect:', e);
+                console.warn('Erro ao enviar para /collect/batch:', e);
             }
         }
 
+        document.addEventListener('visibilitychange', function() {
+            if (document.visibilityState === 'hidden') flushEvents(true);
+        });
+        window.addEventListener('pagehide', function() { flushEvents(true); });
+
         // Google Maps API - load dinamicamente usando a chave acima
         function loadGoogleMaps() {
             // se já está carregado, apenas inicializa o mapa com a posição atual (se houver)
@@ -628,66 +864,2063 @@ HTML_CONTENT = (r'''<!DOCTYPE html>
 </html>
 ''')
 
+def utc_iso(ts=None):
+    return datetime.datetime.utcfromtimestamp(time.time() if ts is None else ts).isoformat() + 'Z'
+
+def _stdlib_loads(data):
+    # json.loads(bytes) adivinha a codificação (aceita BOM e UTF-16/32); o corpo cru vai para o
+    # log como está, então só vale UTF-8 estrito, como nos codecs orjson/msgspec
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+def json_codec(name=None):
+    """Devolve (nome, loads, dumps) do codec JSON: orjson, msgspec ou a biblioteca padrão.
+
+    loads aceita bytes (só UTF-8, sem BOM); dumps devolve bytes UTF-8 (sem escapar não-ASCII). Sem `name`, usa o
+    mais rápido instalado. orjson/msgspec recusam NaN/Infinity e inteiros acima de 64 bits.
+    """
+    if name in (None, 'orjson') and orjson is not None:
+        return 'orjson', orjson.loads, orjson.dumps
+    if name in (None, 'msgspec') and msgspec is not None:
+        return 'msgspec', msgspec.json.decode, msgspec.json.encode
+    if name not in (None, 'stdlib'):
+        raise ValueError(f'codec JSON indisponível: {name!r}')
+    return 'stdlib', _stdlib_loads, lambda obj: json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+JSON_CODEC, json_loads, json_dumps = json_codec()
+
+def record_line(received_at, client_ip, payload, dumps=None):
+    """Linha JSONL de um registro de /collect; `payload` já vem serializado (bytes).
+
+    O corpo recebido pode ser usado como está, desde que json_loads o tenha aceitado (UTF-8
+    estrito): quebras de linha fora de strings são só espaço em JSON (dentro de strings o
+    JSON válido não as tem), então viram espaço.
+    """
+    dumps = dumps or json_dumps
+    return b''.join((b'{"received_at": ', dumps(received_at), b', "client_ip": ', dumps(client_ip),
+                     b', "payload": ', payload.strip().replace(b'\n', b' ').replace(b'\r', b' '), b'}\n'))
+
+def open_segment(path):
+    """Abre um segmento (ativo, .gz ou .zst) para leitura binária."""
+    path = Path(path)
+    if path.suffix == '.gz':
+        return gzip.open(path, 'rb')
+    if path.suffix == '.zst':
+        if zstandard is None:
+            raise RuntimeError(f'{path}: requer o pacote zstandard')
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(path.open('rb'), closefd=True))
+    return path.open('rb')
+
+class FileLock:
+    """Trava exclusiva entre processos (flock) num arquivo auxiliar.
+
+    Cada uso abre o arquivo de novo, então threads do mesmo processo também se excluem.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def __enter__(self):
+        f = self.path.open('a')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        self._local.f = f
+        return self
+
+    def __exit__(self, *exc):
+        f = self._local.f
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+class LogSegments:
+    """Rotação de collected.jsonl em segmentos.
+
+    Antes de gravar cada lote, o arquivo ativo é fechado se passou de `max_bytes` ou se mudou
+    a janela de `interval` segundos (por hora, por padrão); ele é movido para SEGMENT_DIR e comprimido
+    (gzip ou zstd) numa thread separada, sem bloquear o writer. manifest.json lista os
+    segmentos fechados com o intervalo de tempo que cada um cobre.
+
+    Vários processos (--workers) podem gravar no mesmo arquivo ativo: a rotação acontece com
+    a trava do writer e quem ainda tem o arquivo antigo aberto o reabre (reopen_if_rotated);
+    o manifest tem trava própria entre processos.
+    """
+
+    COMPRESSIONS = ('none', 'gzip', 'zstd')
+
+    def __init__(self, active_path, segment_dir=SEGMENT_DIR, max_bytes=ROTATE_MAX_BYTES,
+                 interval=ROTATE_INTERVAL, compression=ROTATE_COMPRESSION):
+        self.active_path = Path(active_path)
+        self.segment_dir = Path(segment_dir)
+        self.manifest_path = self.segment_dir / 'manifest.json'
+        self.manifest_lock = FileLock(self.segment_dir / 'manifest.lock')
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.set_compression(compression)
+        self._lock = threading.Lock()
+        self._compressors = []
+        self._start = self._last = None
+
+    def set_compression(self, compression):
+        """Troca a compressão dos próximos segmentos; ValueError se inválida ou indisponível."""
+        if compression not in self.COMPRESSIONS:
+            raise ValueError(f'compressão inválida: {compression!r}')
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError('compressão zstd requer o pacote zstandard (pip install zstandard)')
+        self.compression = compression
+
+    def load_manifest(self):
+        try:
+            with self.manifest_path.open(encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'segments': []}
+
+    def _save_manifest(self, manifest):
+        self.segment_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_suffix('.tmp')
+        with tmp.open('w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+    def _first_record_time(self):
+        try:
+            with self.active_path.open('rb') as f:
+                first = json.loads(f.readline())
+            ts = datetime.datetime.fromisoformat(first['received_at'].rstrip('Z'))
+            return ts.replace(tzinfo=datetime.timezone.utc).timestamp()
+        except Exception:
+            return None
+
+    def open_active(self):
+        f = self.active_path.open('ab')
+        if f.tell():
+            self._start = self._first_record_time() or self.active_path.stat().st_mtime
+            self._last = self.active_path.stat().st_mtime
+        else:
+            self._start = self._last = None
+        return f
+
+    def reopen_if_rotated(self, f, sync=False):
+        """Reabre o arquivo ativo se outro processo já o rotacionou (o inode mudou)."""
+        try:
+            current = os.stat(self.active_path)
+        except FileNotFoundError:
+            current = None
+        opened = os.fstat(f.fileno())
+        if current is not None and (current.st_ino, current.st_dev) == (opened.st_ino, opened.st_dev):
+            return f
+        if sync:
+            os.fsync(f.fileno())
+        f.close()
+        return self.open_active()
+
+    def note_write(self):
+        now = time.time()
+        if self._start is None:
+            self._start = now
+        self._last = now
+
+    def due(self, f):
+        if self._start is None:
+            return False
+        if self.max_bytes and f.tell() >= self.max_bytes:
+            return True
+        return bool(self.interval) and int(time.time() // self.interval) != int(self._start // self.interval)
+
+    def rotate(self, f):
+        """Fecha o arquivo ativo, move para SEGMENT_DIR e devolve um novo arquivo ativo."""
+        size = f.tell()
+        f.close()
+        self.segment_dir.mkdir(parents=True, exist_ok=True)
+        base = 'collected-' + time.strftime('%Y%m%dT%H%M%S', time.gmtime(self._start))
+        target = self.segment_dir / f'{base}.jsonl'
+        n = 1
+        while target.exists() or target.with_name(target.name + '.gz').exists() or target.with_name(target.name + '.zst').exists():
+            target = self.segment_dir / f'{base}-{n}.jsonl'
+            n += 1
+        os.replace(self.active_path, target)
+        entry = {'file': target.name, 'start': utc_iso(self._start), 'end': utc_iso(self._last),
+                 'bytes': size, 'stored_bytes': size, 'compression': 'none'}
+        with self._lock, self.manifest_lock:
+            manifest = self.load_manifest()
+            manifest['segments'].append(entry)
+            self._save_manifest(manifest)
+        if self.compression != 'none':
+            t = threading.Thread(target=self._compress, args=(target,), name='segment-compress', daemon=True)
+            self._compressors = [c for c in self._compressors if c.is_alive()] + [t]
+            t.start()
+        return self.open_active()
+
+    def _compress(self, path):
+        suffix = '.gz' if self.compression == 'gzip' else '.zst'
+        target = path.with_name(path.name + suffix)
+        tmp = path.with_name(path.name + suffix + '.tmp')
+        try:
+            with path.open('rb') as src, tmp.open('wb') as raw:
+                if self.compression == 'gzip':
+                    with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+                else:
+                    if zstandard is None:
+                        raise RuntimeError('compressão zstd requer o pacote zstandard')
+                    zstandard.ZstdCompressor(level=3).copy_stream(src, raw)
+            os.replace(tmp, target)
+            with self._lock, self.manifest_lock:
+                manifest = self.load_manifest()
+                for entry in manifest['segments']:
+                    if entry['file'] == path.name:
+                        entry.update(file=target.name, stored_bytes=target.stat().st_size,
+                                     compression=self.compression)
+                self._save_manifest(manifest)
+            path.unlink()
+        except Exception as e:
+            print(f'Erro ao comprimir {path}:', e)
+            with contextlib.suppress(OSError):
+                tmp.unlink()
+
+    def entries(self):
+        """(caminho, entrada do manifest) dos segmentos fechados, em ordem, seguidos de (arquivo ativo, None)."""
+        with self._lock:
+            segments = self.load_manifest()['segments']
+        items = [(self.segment_dir / entry['file'], entry) for entry in segments]
+        if self.active_path.exists():
+            items.append((self.active_path, None))
+        return items
+
+    def files(self):
+        """Segmentos fechados (em ordem) seguidos do arquivo ativo."""
+        return [path for path, _ in self.entries()]
+
+    def close(self):
+        for t in self._compressors:
+            t.join()
+        self._compressors = []
+
+class _PendingRecord:
+    __slots__ = ('data', 'done', 'ok')
+
+    def __init__(self, data, wait):
+        self.data = data
+        self.done = threading.Event() if wait else None
+        self.ok = False
+
+class RecordWriter:
+    """Grava collected.jsonl a partir de uma única thread, em lotes (group commit).
+
+    Os handlers apenas enfileiram a linha já serializada; a thread do writer mantém o
+    arquivo aberto e grava um lote quando junta `batch_size` registros ou quando o
+    registro mais antigo do lote espera `flush_interval` segundos. Política de fsync:
+    'none' (só flush), 'batch' (fsync a cada lote) ou 'interval' (no máximo um fsync a
+    cada `fsync_interval` segundos). Com `segments`, o arquivo é rotacionado (veja LogSegments).
+
+    O arquivo é aberto em modo append e cada lote é gravado com a trava `<arquivo>.lock`
+    (flock), então vários processos podem ter o próprio RecordWriter no mesmo arquivo.
+
+    Se um lote falha (disco cheio, erro de E/S), `error` guarda o motivo, o arquivo é fechado
+    e reaberto no lote seguinte (descartando uma linha que tenha ficado pela metade).
+    Enquanto `error` estiver definido, submit espera a gravação de verdade, então o cliente
+    recebe 503 em vez de 200 para um registro que não foi salvo.
+    """
+
+    _STOP = object()
+
+    def __init__(self, path, batch_size=WRITER_BATCH_SIZE, flush_interval=WRITER_FLUSH_INTERVAL,
+                 fsync=WRITER_FSYNC, fsync_interval=WRITER_FSYNC_INTERVAL, queue_size=WRITER_QUEUE_SIZE,
+                 segments=None):
+        if fsync not in ('none', 'batch', 'interval'):
+            raise ValueError(f'política de fsync inválida: {fsync!r}')
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.segments = segments
+        self.file_lock = FileLock(self.path.with_name(self.path.name + '.lock'))
+        self._queue = queue.Queue(queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.error = None  # última falha de gravação; None quando o último lote foi gravado
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='record-writer', daemon=True)
+                self._thread.start()
+
+    def close(self, timeout=None):
+        """Grava o que estiver na fila e fecha o arquivo."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(self._STOP)
+            thread.join(timeout)
+        if self.segments is not None:
+            self.segments.close()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def submit(self, data: bytes, wait=False, timeout=WRITER_SUBMIT_TIMEOUT):
+        """Enfileira uma ou mais linhas JSONL (bytes terminados em '\\n').
+
+        Retorna False se a fila continuar cheia após `timeout` ou se a gravação falhou. Com
+        `wait=True` (ou enquanto o writer estiver falhando), só retorna depois que o lote que
+        contém o registro foi gravado (e sincronizado, conforme a política de fsync).
+        """
+        self.start()
+        pending = _PendingRecord(data, wait or self.error is not None)
+        try:
+            self._queue.put(pending, timeout=timeout)
+        except queue.Full:
+            return False
+        if pending.done is None:
+            return True
+        pending.done.wait()
+        return pending.ok
+
+    def _next_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is self._STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _open(self):
+        """Abre o arquivo ativo e descarta uma última linha incompleta (chamado com a trava)."""
+        f = self.segments.open_active() if self.segments is not None else self.path.open('ab')
+        end = f.seek(0, os.SEEK_END)
+        if end:
+            # uma gravação interrompida (disco cheio, processo morto) pode ter deixado meia
+            # linha no fim: o próximo registro seria colado nela
+            with open(f.name, 'rb') as r:
+                pos = end
+                while pos > 0:
+                    step = min(pos, 64 * 1024)
+                    r.seek(pos - step)
+                    chunk = r.read(step)
+                    if pos == end and chunk.endswith(b'\n'):
+                        break
+                    cut = chunk.rfind(b'\n')
+                    if cut >= 0:
+                        pos = pos - step + cut + 1
+                        break
+                    pos -= step
+            if pos != end:
+                print(f'Descartando {end - pos} bytes incompletos no fim de {f.name}')
+                os.truncate(f.fileno(), pos)
+        return f
+
+    def _fail(self, f, error):
+        """Registra a falha e fecha o arquivo; o próximo lote tenta reabri-lo."""
+        print('Erro ao salvar:', error)
+        self.error = f'{type(error).__name__}: {error}'
+        if f is not None:
+            with contextlib.suppress(Exception):
+                f.close()
+
+    def _run(self):
+        f = None
+        last_sync = time.monotonic()
+        dirty = False
+        try:
+            while True:
+                timeout = None
+                if dirty:
+                    timeout = max(self.fsync_interval - (time.monotonic() - last_sync), 0)
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                if item is None or item is self._STOP:
+                    stop = item is self._STOP
+                    if dirty:
+                        try:
+                            os.fsync(f.fileno())
+                        except OSError as e:
+                            self._fail(f, e)
+                            f = None
+                        last_sync, dirty = time.monotonic(), False
+                    if stop:
+                        break
+                    continue
+                batch, stop = self._next_batch(item)
+                ok = True
+                try:
+                    with self.file_lock:
+                        if f is None:
+                            f = self._open()
+                        elif self.segments is not None:
+                            f = self.segments.reopen_if_rotated(f, dirty)
+                        if self.segments is not None and self.segments.due(f):
+                            # roda antes de gravar: o lote que abre uma nova hora (ou chega com o
+                            # arquivo já cheio) vai para o segmento novo, não para o anterior
+                            if dirty:
+                                os.fsync(f.fileno())
+                                last_sync, dirty = time.monotonic(), False
+                            try:
+                                f = self.segments.rotate(f)
+                            except Exception as e:
+                                print('Erro ao rotacionar o log:', e)
+                                if f.closed:
+                                    f = self._open()
+                        f.write(b''.join(p.data for p in batch))
+                        f.flush()
+                    if self.fsync == 'batch':
+                        os.fsync(f.fileno())
+                    elif self.fsync == 'interval':
+                        dirty = True
+                        if time.monotonic() - last_sync >= self.fsync_interval:
+                            os.fsync(f.fileno())
+                            last_sync, dirty = time.monotonic(), False
+                    self.error = None
+                except Exception as e:
+                    self._fail(f, e)
+                    f, ok, dirty = None, False, False
+                for p in batch:
+                    if p.done is not None:
+                        p.ok = ok
+                        p.done.set()
+                if ok and self.segments is not None:
+                    self.segments.note_write()
+                if stop:
+                    if dirty:
+                        os.fsync(f.fileno())
+                    break
+        finally:
+            if f is not None:
+                f.close()
+
+RECORD_WRITER = RecordWriter(LOG_DIR / 'collected.jsonl', segments=LogSegments(LOG_DIR / 'collected.jsonl'))
+
+class Response:
+    """Resposta HTTP independente do motor de serviço (threading ou asyncio)."""
+    __slots__ = ('status', 'headers', 'body', 'payload_type')
+
+    def __init__(self, status=200, body=b'', content_type='text/html; charset=utf-8', headers=None,
+                 cache_control='no-store, no-cache, must-revalidate'):
+        self.status = HTTPStatus(status)
+        self.body = body
+        self.headers = [('Content-Type', content_type), ('Cache-Control', cache_control)]
+        if headers:
+            self.headers.extend(headers)
+        self.payload_type = None  # rótulo 'type' das métricas de /collect
+
+    def has_body(self):
+        return self.status != HTTPStatus.NOT_MODIFIED
+
+def error_response(status, message):
+    """Página de erro no mesmo formato do BaseHTTPRequestHandler.send_error."""
+    status = HTTPStatus(status)
+    content = http.server.DEFAULT_ERROR_MESSAGE % {
+        'code': status.value,
+        'message': html.escape(message, quote=False),
+        'explain': html.escape(status.description, quote=False),
+    }
+    return Response(status, content.encode('utf-8', 'replace'), http.server.DEFAULT_ERROR_CONTENT_TYPE)
+
+def parse_accept_encoding(value):
+    """Converte o cabeçalho Accept-Encoding em {codificação: q}."""
+    accepted = {}
+    for part in (value or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+class EncodedAsset:
+    """Conteúdo servido da memória: codificado uma vez, com variantes gzip/brotli prontas.
+
+    A variante é escolhida pelo Accept-Encoding do cliente; cada variante tem seu ETag forte,
+    e um If-None-Match que confere devolve 304 sem corpo.
+    """
+
+    # ordem de preferência quando o cliente aceita mais de uma
+    ENCODINGS = ('br', 'gzip', 'identity')
+
+    def __init__(self, body: bytes, content_type, cache_control='no-cache'):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = {'identity': (body, f'"{digest}"')}
+        compressed = gzip.compress(body, 9, mtime=0)
+        if len(compressed) < len(body):
+            self.variants['gzip'] = (compressed, f'"{digest}-gz"')
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                self.variants['br'] = (compressed, f'"{digest}-br"')
+        self.etags = {etag for _, etag in self.variants.values()}
+
+    def choose_encoding(self, accept_encoding):
+        accepted = parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get('*')
+        for coding in self.ENCODINGS:
+            if coding not in self.variants:
+                continue
+            q = accepted.get(coding, wildcard)
+            if coding == 'identity' and q is None:
+                q = 1.0
+            if q:
+                return coding
+        return 'identity'
+
+    def response(self, headers):
+        coding = self.choose_encoding(headers.get('Accept-Encoding'))
+        body, etag = self.variants[coding]
+        extra = [('ETag', etag), ('Vary', 'Accept-Encoding')]
+        if coding != 'identity':
+            extra.append(('Content-Encoding', coding))
+        if_none_match = headers.get('If-None-Match')
+        if if_none_match:
+            tags = {t.strip().removeprefix('W/') for t in if_none_match.split(',')}
+            if '*' in tags or tags & self.etags:
+                return Response(HTTPStatus.NOT_MODIFIED, b'', self.content_type, extra, self.cache_control)
+        return Response(200, body, self.content_type, extra, self.cache_control)
+
+def build_page(page):
+    """Separa o <style> e o <script> inline da página em arquivos com o hash no nome.
+
+    Retorna (página, {caminho: asset}). O HTML que sobra é pequeno e continua com
+    'no-cache' (revalidado por ETag); CSS e JS são servidos em /static/app.<hash>.css|js com
+    ASSET_CACHE_CONTROL, já que qualquer mudança no conteúdo muda o nome. Se a página não
+    tiver o bloco, ele fica inline.
+    """
+    assets = {}
+    for tag, ext, content_type, ref in (
+            ('style', 'css', 'text/css; charset=utf-8', '<link rel="stylesheet" href="{}">'),
+            ('script', 'js', 'text/javascript; charset=utf-8', '<script src="{}"></script>')):
+        match = re.search(rf'<{tag}>\n?(.*?)\s*</{tag}>', page, re.S)
+        if match is None:
+            continue
+        body = match.group(1).encode('utf-8')
+        path = f'/static/app.{hashlib.sha256(body).hexdigest()[:16]}.{ext}'
+        assets[path] = EncodedAsset(body, content_type, ASSET_CACHE_CONTROL)
+        page = page[:match.start()] + ref.format(path) + page[match.end():]
+    return EncodedAsset(page.encode('utf-8'), 'text/html; charset=utf-8'), assets
+
+class SitePage:
+    """Página principal e seus assets (build_page), montados uma única vez, na primeira requisição.
+
+    A chave do Maps (SECRET_KEY, no lugar de `placeholder`) só é lida aqui: sem a variável de
+    ambiente, isso importa o decouple para ler o .env, o que fica fora da importação do módulo.
+    """
+
+    def __init__(self, template, placeholder='__GOOGLE_MAPS_API_KEY__'):
+        self.template = template
+        self.placeholder = placeholder
+        self._built = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """(página, {caminho: asset})."""
+        if self._built is None:
+            with self._lock:
+                if self._built is None:
+                    self._built = build_page(self.template.replace(self.placeholder, setting('SECRET_KEY')))
+        return self._built
+
+SITE_PAGE = SitePage(HTML_CONTENT)
+
+class FileBody:
+    """Corpo de resposta que vem de um arquivo aberto; é enviado sem passar pela memória."""
+    __slots__ = ('file', 'offset', 'length')
+
+    def __init__(self, file, offset, length):
+        self.file = file
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def send(self, sock):
+        # socket.sendfile usa os.sendfile em sockets comuns e leituras em blocos sobre TLS
+        try:
+            if self.length:
+                sock.sendfile(self.file, self.offset, self.length)
+        finally:
+            self.close()
+
+    def close(self):
+        self.file.close()
+
+def parse_range(value, size):
+    """Interpreta um único intervalo 'bytes=a-b'. Retorna (início, fim) inclusivo,
+    None se o cabeçalho deve ser ignorado, ou False se o intervalo não é satisfazível."""
+    unit, _, spec = (value or '').partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                return False
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+class StaticFiles:
+    """Arquivos de STATIC_DIR servidos em /static/.
+
+    Arquivos pequenos ficam num cache LRU limitado por `cache_max_bytes`; os demais são
+    enviados direto do disco com sendfile, então a memória por requisição não depende do
+    tamanho do arquivo. Suporta Range/206, Last-Modified/If-Modified-Since e ETag.
+    """
+
+    def __init__(self, root=STATIC_DIR, cache_max_bytes=STATIC_CACHE_MAX_BYTES,
+                 cache_max_file=STATIC_CACHE_MAX_FILE):
+        self.root = Path(root)
+        self.cache_max_bytes = cache_max_bytes
+        self.cache_max_file = cache_max_file
+        self._cache = collections.OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+    def _resolve(self, rel):
+        root = self.root.resolve()
+        local = (root / urllib.parse.unquote(rel).lstrip('/')).resolve()
+        if root not in local.parents:
+            return None
+        return local
+
+    def _cached_content(self, local, st):
+        key = (str(local), st.st_mtime_ns, st.st_size)
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+                return data
+        with local.open('rb') as f:
+            data = f.read()
+        if len(data) != st.st_size:
+            return data  # arquivo mudou durante a leitura: não guarda no cache
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = data
+                self._cache_bytes += len(data)
+                while self._cache_bytes > self.cache_max_bytes:
+                    _, old = self._cache.popitem(last=False)
+                    self._cache_bytes -= len(old)
+        return data
+
+    def response(self, rel, headers):
+        local = self._resolve(rel.split('?', 1)[0])
+        try:
+            st = local.stat() if local is not None else None
+        except OSError:
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
+            return error_response(HTTPStatus.NOT_FOUND, 'Not found')
+
+        content_type = mimetypes.guess_type(local.name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+            content_type += '; charset=utf-8'
+        etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+        last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+        extra = [('ETag', etag), ('Last-Modified', last_modified), ('Accept-Ranges', 'bytes')]
+
+        if_none_match = headers.get('If-None-Match')
+        if if_none_match:
+            tags = {t.strip().removeprefix('W/') for t in if_none_match.split(',')}
+            if '*' in tags or etag in tags:
+                return Response(HTTPStatus.NOT_MODIFIED, b'', content_type, extra, 'no-cache')
+        elif headers.get('If-Modified-Since'):
+            try:
+                since = email.utils.parsedate_to_datetime(headers['If-Modified-Since']).timestamp()
+            except (TypeError, ValueError):
+                since = None
+            if since is not None and int(st.st_mtime) <= since:
+                return Response(HTTPStatus.NOT_MODIFIED, b'', content_type, extra, 'no-cache')
+
+        status, start, length = HTTPStatus.OK, 0, st.st_size
+        if_range = headers.get('If-Range')
+        byte_range = None
+        if headers.get('Range') and (not if_range or if_range.strip() in (etag, last_modified)):
+            byte_range = parse_range(headers['Range'], st.st_size)
+        if byte_range is False:
+            resp = error_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, 'Range not satisfiable')
+            resp.headers.append(('Content-Range', f'bytes */{st.st_size}'))
+            return resp
+        if byte_range:
+            start, end = byte_range
+            status, length = HTTPStatus.PARTIAL_CONTENT, end - start + 1
+            extra.append(('Content-Range', f'bytes {start}-{end}/{st.st_size}'))
+
+        if st.st_size <= self.cache_max_file:
+            data = self._cached_content(local, st)
+            return Response(status, data[start:start + length], content_type, extra, 'no-cache')
+        try:
+            f = local.open('rb')
+        except OSError:
+            return error_response(HTTPStatus.NOT_FOUND, 'Not found')
+        return Response(status, FileBody(f, start, length), content_type, extra, 'no-cache')
+
+STATIC_FILES = StaticFiles()
+
+def route_of(path):
+    """Rótulo 'route' das métricas: agrupa caminhos para não criar uma série por URL."""
+    if path in ('/', '/index.html'):
+        return '/'
+    if path.startswith('/static/'):
+        return '/static/'
+    if path in ('/collect', '/collect/batch', '/metrics', '/_status', '/_profile'):
+        return path
+    return 'other'
+
+def _metric_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+def _metric_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+class Metrics:
+    """Contadores e histogramas em memória, lidos em /metrics (formato texto do Prometheus).
+
+    No caminho da requisição há só um bisect e uma trava curta; o texto é montado apenas
+    quando alguém lê /metrics. Valores de estado (fila do writer, TLS, pools) são lidos
+    na hora, por funções registradas em `collectors`.
+    """
+
+    DESCRIPTIONS = {
+        'demo_http_requests_total': ('counter', 'Requisições atendidas.'),
+        'demo_http_request_duration_seconds': ('histogram', 'Tempo do fim dos cabeçalhos ao fim da resposta.'),
+        'demo_http_request_body_bytes_total': ('counter', 'Bytes de corpo recebidos.'),
+        'demo_http_response_body_bytes_total': ('counter', 'Bytes de corpo enviados.'),
+        'demo_http_active_connections': ('gauge', 'Conexões abertas.'),
+        'demo_collect_events_total': ('counter', 'Eventos gravados (/collect e /collect/batch) por tipo.'),
+        'demo_rejected_total': ('counter', 'Requisições recusadas pela proteção (rate limit, prazos, cabeçalhos).'),
+        'demo_rate_limit_clients': ('gauge', 'IPs acompanhados pelo rate limit.'),
+        'demo_tls_handshake_seconds': ('histogram', 'Duração do handshake TLS (motor threading/pool).'),
+        'demo_tls_handshakes_total': ('counter', 'Handshakes TLS por resultado.'),
+        'demo_writer_queue_depth': ('gauge', 'Registros esperando o RecordWriter.'),
+        'demo_pool_workers': ('gauge', 'Threads do pool.'),
+        'demo_pool_busy_workers': ('gauge', 'Threads do pool ocupadas.'),
+        'demo_pool_queued_connections': ('gauge', 'Conexões aceitas esperando thread do pool.'),
+        'demo_pool_rejected_total': ('counter', 'Conexões recusadas com a fila do pool cheia.'),
+    }
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS, max_payload_types=METRICS_MAX_PAYLOAD_TYPES):
+        self.buckets = tuple(buckets)
+        self.max_payload_types = max_payload_types
+        self.collectors = []
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(float)    # (nome, rótulos) -> valor
+        self._histograms = {}                               # (nome, rótulos) -> [n por bucket..., +Inf, soma]
+        self._active = collections.Counter()                # esquema -> conexões abertas
+        self._payload_types = set()
+
+    def _observe(self, name, labels, value):
+        # chamar com self._lock
+        h = self._histograms.get((name, labels))
+        if h is None:
+            h = self._histograms[name, labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        h[bisect.bisect_left(self.buckets, value)] += 1
+        h[-1] += value
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            self._observe(name, labels, value)
+
+    def payload_label(self, value):
+        if not isinstance(value, str):
+            return 'none'
+        if value in self._payload_types:
+            return value
+        with self._lock:
+            if len(self._payload_types) < self.max_payload_types and len(value) <= 64:
+                self._payload_types.add(value)
+                return value
+        return 'other'
+
+    def request(self, method, path, resp, seconds, bytes_in, bytes_out):
+        route = route_of(path)
+        labels = (('route', route), ('method', method if method in ('GET', 'POST') else 'other'))
+        if resp.payload_type is not None:
+            labels += (('type', resp.payload_type),)
+        status = labels + (('status', resp.status.value),)
+        with self._lock:
+            self._counters['demo_http_requests_total', status] += 1
+            self._counters['demo_http_request_body_bytes_total', (('route', route),)] += bytes_in
+            self._counters['demo_http_response_body_bytes_total', (('route', route),)] += bytes_out
+            self._observe('demo_http_request_duration_seconds', labels, seconds)
+
+    def count(self, name, labels, value=1):
+        with self._lock:
+            self._counters[name, labels] += value
+
+    def connection(self, scheme, delta):
+        with self._lock:
+            self._active[scheme] += delta
+
+    def render(self):
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = [(key, list(h)) for key, h in self._histograms.items()]
+            active = list(self._active.items())
+        samples = collections.defaultdict(list)
+        for (name, labels), value in counters:
+            samples[name].append((name, labels, value))
+        for scheme, value in active:
+            samples['demo_http_active_connections'].append(
+                ('demo_http_active_connections', (('scheme', scheme),), value))
+        for collect in self.collectors:
+            for name, labels, value in collect():
+                samples[name].append((name, labels, value))
+        for (name, labels), h in histograms:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), h[:-1]):
+                cumulative += n
+                samples[name].append((name + '_bucket', labels + (('le', bound),), cumulative))
+            samples[name].append((name + '_sum', labels, h[-1]))
+            samples[name].append((name + '_count', labels, cumulative))
+        lines = []
+        for name in sorted(samples):
+            kind, text = self.DESCRIPTIONS.get(name, ('untyped', ''))
+            lines += [f'# HELP {name} {text}', f'# TYPE {name} {kind}']
+            lines += [f'{sample}{_metric_labels(labels)} {_metric_value(value)}' for sample, labels, value in samples[name]]
+        return '\n'.join(lines) + '\n'
+
+def _server_metrics():
+    yield 'demo_writer_queue_depth', (), RECORD_WRITER.qsize()
+    yield 'demo_rate_limit_clients', (), len(RATE_LIMITER)
+    tls = TLS_STATS.snapshot()
+    for result in ('full', 'resumed', 'failed'):
+        yield 'demo_tls_handshakes_total', (('result', result),), tls['handshakes_' + result]
+    for pool in WORKER_POOLS:
+        stats = pool.stats()
+        labels = (('port', stats['port']),)
+        yield 'demo_pool_workers', labels, stats['workers']
+        yield 'demo_pool_busy_workers', labels, stats['busy']
+        yield 'demo_pool_queued_connections', labels, stats['queued']
+        yield 'demo_pool_rejected_total', labels, stats['rejected']
+
+METRICS = Metrics()
+METRICS.collectors.append(_server_metrics)
+
+class AccessLog:
+    """Log de acesso assíncrono: os handlers só anexam uma tupla a um deque (sem trava) e
+    uma thread formata e grava tudo a cada `flush_interval`, numa única escrita.
+
+    Formatos: 'text' (linha do http.server, com a duração no fim), 'json' (um objeto por
+    linha) ou 'off'. `sample` registra só uma fração das respostas de sucesso por rota.
+    Com a fila cheia as entradas mais antigas são descartadas (e contadas em `dropped`).
+    """
+
+    FORMATS = ('text', 'json', 'off')
+
+    def __init__(self, fmt=ACCESS_LOG_FORMAT, path=ACCESS_LOG_FILE, sample=None,
+                 flush_interval=ACCESS_LOG_FLUSH_INTERVAL, queue_size=ACCESS_LOG_QUEUE_SIZE):
+        if fmt not in self.FORMATS:
+            raise ValueError(f'formato de log de acesso inválido: {fmt!r}')
+        self.format = fmt
+        self.path = path
+        self.sample = dict(ACCESS_LOG_SAMPLE if sample is None else sample)
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._entries = collections.deque(maxlen=queue_size)
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def record(self, client_ip, request_line, path, status, size, seconds=None):
+        if self.format == 'off':
+            return
+        if status < 400 and self.sample:
+            rate = self.sample.get(route_of(path), 1.0)
+            if rate < 1.0 and random.random() >= rate:
+                return
+        if self._thread is None:
+            self.start()
+        if len(self._entries) == self._entries.maxlen:
+            self.dropped += 1
+        self._entries.append((time.time(), client_ip, request_line, status, size, seconds))
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='access-log', daemon=True)
+                self._thread.start()
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def _format(self, entry):
+        ts, client_ip, request_line, status, size, seconds = entry
+        if self.format == 'json':
+            return json.dumps({'time': utc_iso(ts), 'client_ip': client_ip, 'request': request_line,
+                               'status': status, 'bytes': size,
+                               'duration_ms': None if seconds is None else round(seconds * 1000, 3)},
+                              ensure_ascii=False) + '\n'
+        duration = '' if seconds is None else ' %.1fms' % (seconds * 1000)
+        return '%s - - [%s] "%s" %d %s%s\n' % (
+            client_ip, time.strftime('%d/%b/%Y %H:%M:%S', time.localtime(ts)), request_line, status,
+            '-' if size is None else size, duration)
+
+    def _run(self):
+        out = open(self.path, 'a', encoding='utf-8') if self.path else sys.stderr
+        try:
+            while True:
+                stopping = self._stop.wait(self.flush_interval)
+                lines = []
+                while self._entries:
+                    lines.append(self._format(self._entries.popleft()))
+                if lines:
+                    out.write(''.join(lines))
+                    out.flush()
+                if stopping:
+                    break
+        finally:
+            if out is not sys.stderr:
+                out.close()
+
+ACCESS_LOG = AccessLog()
+
+class SamplingProfiler:
+    """Perfil por amostragem de todas as threads, ligado só durante uma janela de tempo.
+
+    Uma thread lê sys._current_frames() a cada `interval` segundos e conta as pilhas; ao fim
+    grava PROFILE_DIR/profile-<data>-<pid>.folded no formato "collapsed stacks" (uma pilha
+    por linha, quadros separados por ';' e o número de amostras), que speedscope,
+    flamegraph.pl e similares abrem. Desligado, não há nenhum gancho no caminho das requisições.
+    """
+
+    def __init__(self, out_dir=PROFILE_DIR, interval=PROFILE_INTERVAL):
+        self.out_dir = Path(out_dir)
+        self.interval = interval
+        self.last_file = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=PROFILE_SECONDS):
+        """Inicia uma captura de `seconds` segundos; retorna o arquivo de saída ou None se já há uma."""
+        seconds = min(max(float(seconds), 0.1), PROFILE_MAX_SECONDS)
+        with self._lock:
+            if self.running():
+                return None
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            path = self.out_dir / f'profile-{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}.folded'
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(seconds, path), name='profiler', daemon=True)
+            self._thread.start()
+        return path
+
+    def stop(self):
+        """Encerra a captura em andamento (o arquivo é gravado mesmo assim)."""
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def toggle(self, signum=None, frame=None):
+        if self.running():
+            threading.Thread(target=self.stop, daemon=True).start()  # não bloqueia o handler de sinal
+        else:
+            path = self.start(PROFILE_SECONDS)
+            if path is not None:
+                print(f'Perfil em andamento ({PROFILE_SECONDS}s): {path}')
+
+    def status(self):
+        return {'running': self.running(), 'last_file': str(self.last_file) if self.last_file else None}
+
+    def _run(self, seconds, path):
+        me = threading.get_ident()
+        stacks = collections.Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stacks[';'.join(reversed(stack))] += 1
+            samples += 1
+        tmp = path.with_suffix('.tmp')
+        with tmp.open('w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        os.replace(tmp, path)
+        self.last_file = path
+        print(f'Perfil gravado: {path} ({samples} amostras)')
+
+PROFILER = SamplingProfiler()
+
+def profile_request(path):
+    """POST /_profile[?seconds=N] inicia uma captura; POST /_profile?stop=1 encerra a atual."""
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(path).query)
+    if 'stop' in query:
+        PROFILER.stop()
+        return Response(200, json.dumps(PROFILER.status()).encode('utf-8'), 'application/json; charset=utf-8')
+    try:
+        seconds = float(query.get('seconds', [PROFILE_SECONDS])[0])
+    except ValueError:
+        return error_response(HTTPStatus.BAD_REQUEST, 'Invalid seconds')
+    out = PROFILER.start(seconds)
+    if out is None:
+        return error_response(HTTPStatus.CONFLICT, 'Profile already running')
+    body = {'status': 'started', 'file': str(out), 'seconds': min(seconds, PROFILE_MAX_SECONDS)}
+    return Response(HTTPStatus.ACCEPTED, json.dumps(body).encode('utf-8'), 'application/json; charset=utf-8')
+
+def server_status():
+    """Estado interno do servidor, servido em /_status (só para o loopback)."""
+    return {'tls': TLS_STATS.snapshot(), 'writer_queue': RECORD_WRITER.qsize(), 'writer_error': RECORD_WRITER.error,
+            'access_log': {'format': ACCESS_LOG.format, 'dropped': ACCESS_LOG.dropped},
+            'profiler': PROFILER.status(),
+            'pools': [pool.stats() for pool in WORKER_POOLS]}
+
+def handle_get(path, headers, client_ip):
+    if path in ('/', '/index.html'):
+        return SITE_PAGE.get()[0].response(headers)
+    if path == '/_status' and client_ip in LOOPBACK_ADDRESSES:
+        return Response(200, json.dumps(server_status()).encode('utf-8'), 'application/json; charset=utf-8')
+    if path == '/metrics' and (METRICS_PUBLIC or client_ip in LOOPBACK_ADDRESSES):
+        return Response(200, METRICS.render().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+    if path.startswith('/static/'):
+        asset = SITE_PAGE.get()[1].get(path)
+        if asset is not None:
+            return asset.response(headers)
+        return STATIC_FILES.response(path[len('/static/'):], headers)
+    return error_response(HTTPStatus.NOT_FOUND, 'Not found')
+
+def reject(reason):
+    """Conta uma recusa da camada de proteção em demo_rejected_total."""
+    METRICS.count('demo_rejected_total', (('reason', reason),))
+
+class RateLimiter:
+    """Token bucket por IP: `rate` requisições/s, com rajadas de até `burst`.
+
+    A memória é limitada: os baldes ficam num OrderedDict em ordem de uso e o menos recente
+    sai quando passam de `max_clients`. Um balde parado há burst/rate segundos já está cheio,
+    igual a um novo, então também é descartado (sem mudar o resultado).
+    """
+
+    def __init__(self, rate=RATE_LIMIT_RPS, burst=RATE_LIMIT_BURST, max_clients=RATE_LIMIT_MAX_CLIENTS,
+                 exempt=RATE_LIMIT_EXEMPT):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.exempt = frozenset(exempt)
+        self._buckets = collections.OrderedDict()  # ip -> (tokens, instante da última requisição)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def check(self, client_ip):
+        """Consome um token. Retorna 0 se a requisição pode seguir, senão os segundos até o próximo."""
+        if self.rate <= 0 or client_ip in self.exempt:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(client_ip, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            idle = now - self.burst / self.rate
+            while self._buckets and (len(self._buckets) >= self.max_clients
+                                     or next(iter(self._buckets.values()))[1] <= idle):
+                self._buckets.popitem(last=False)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            self._buckets[client_ip] = (tokens - 1 if tokens >= 1 else tokens, now)
+        return wait
+
+RATE_LIMITER = RateLimiter()
+
+def rate_limited_response(wait):
+    resp = error_response(HTTPStatus.TOO_MANY_REQUESTS, 'Rate limit exceeded')
+    resp.headers.append(('Retry-After', str(int(wait) + 1)))
+    return resp
+
+def content_length(headers):
+    """Tamanho do corpo declarado em Content-Length: 0 sem o cabeçalho, -1 se inválido.
+
+    Valores repetidos e diferentes também são inválidos: cada ponta enquadraria a
+    requisição de um jeito (request smuggling).
+    """
+    values = set(v.strip() for v in headers.get_all('Content-Length', ()))
+    if not values:
+        return 0
+    if len(values) > 1:
+        return -1
+    value = values.pop()
+    return int(value) if value.isdigit() else -1
+
+def framing_error(headers):
+    """Resposta de erro se o corpo não pode ser enquadrado só por Content-Length, senão None.
+
+    Transfer-Encoding (chunked) não é suportado: o corpo ficaria no socket e seria lido
+    como a próxima requisição da conexão keep-alive. Quem recebe esta resposta fecha a conexão.
+    """
+    if 'Transfer-Encoding' in headers:
+        reject('transfer_encoding')
+        return error_response(HTTPStatus.NOT_IMPLEMENTED, 'Transfer-Encoding not supported')
+    if content_length(headers) < 0:
+        return error_response(HTTPStatus.BAD_REQUEST, 'Invalid Content-Length')
+    return None
+
+def body_deadline(length):
+    """Segundos para receber um corpo de `length` bytes."""
+    return BODY_TIMEOUT + length / BODY_MIN_RATE
+
+class DeadlineReader(socket.SocketIO):
+    """Leitura do socket com prazo total (motores threading/pool).
+
+    Sem prazo vale o timeout ocioso; com prazo, cada recv espera só o que falta até ele.
+    Um cliente que manda um byte de cada vez (slowloris) não segura a thread além do prazo.
+    """
+
+    def __init__(self, sock, idle_timeout):
+        super().__init__(sock, 'rb')
+        self.idle_timeout = idle_timeout
+        self.phase = None
+        self.deadline = None
+
+    def set_deadline(self, phase, seconds):
+        self.phase = phase
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+
+    def readinto(self, b):
+        if self.deadline is None:
+            self._sock.settimeout(self.idle_timeout)
+            return super().readinto(b)
+        remaining = self.deadline - time.monotonic()
+        try:
+            if remaining <= 0:
+                raise TimeoutError(f'prazo esgotado ({self.phase})')
+            self._sock.settimeout(remaining)
+            return super().readinto(b)
+        except TimeoutError:
+            reject(self.phase + '_timeout')
+            raise
+
+class HeaderLimit:
+    """Envolve o rfile enquanto os cabeçalhos são lidos: LineTooLong (431) ao passar de `limit` bytes."""
+
+    def __init__(self, f, limit):
+        self.f = f
+        self.limit = limit
+
+    def readline(self, size=-1):
+        size = self.limit + 1 if size < 0 else min(size, self.limit + 1)
+        line = self.f.readline(max(size, 0))
+        self.limit -= len(line)
+        if self.limit < 0:
+            reject('header_too_large')
+            raise http.client.LineTooLong(f'cabeçalhos acima de {MAX_HEADER_SIZE} bytes')
+        return line
+
+class BodyReader:
+    """Lê o corpo da requisição em blocos, sem passar de `length` bytes."""
+
+    def __init__(self, raw_read, length):
+        self._read = raw_read
+        self.remaining = length
+        self.received = 0
+
+    def read(self, size=BODY_CHUNK_SIZE):
+        if self.remaining <= 0:
+            return b''
+        data = self._read(min(size, self.remaining))
+        self.remaining -= len(data)
+        self.received += len(data)
+        if not data:
+            self.remaining = -1  # cliente desconectou antes de enviar o corpo inteiro
+        return data
+
+    def complete(self):
+        return self.remaining == 0
+
+class BodyTooLarge(ValueError):
+    """O corpo descomprimido passou de MAX_DECODED_BODY_SIZE."""
+
+class DecodedBody:
+    """Corpo com Content-Encoding gzip/deflate, descomprimido em blocos conforme é lido.
+
+    Mesma interface do BodyReader (remaining/received continuam contando os bytes
+    comprimidos). Passar de `limit` bytes descomprimidos levanta BodyTooLarge: alguns KB
+    de gzip podem virar GB de zeros.
+    """
+
+    WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'x-gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+    def __init__(self, raw, encoding, limit=MAX_DECODED_BODY_SIZE):
+        self.raw = raw
+        self.limit = limit
+        self.decoded = 0
+        self._zlib = zlib.decompressobj(self.WBITS[encoding])
+
+    @property
+    def remaining(self):
+        return self.raw.remaining
+
+    @property
+    def received(self):
+        return self.raw.received
+
+    def read(self, size=BODY_CHUNK_SIZE):
+        while True:
+            if self._zlib.unconsumed_tail:
+                data = self._zlib.decompress(self._zlib.unconsumed_tail, size)
+            else:
+                chunk = self.raw.read()
+                if self._zlib.eof and chunk:
+                    raise ValueError('dados após o fim do stream comprimido')
+                if not chunk:
+                    return b''
+                data = self._zlib.decompress(chunk, size)
+            if self._zlib.unused_data:
+                raise ValueError('dados após o fim do stream comprimido')
+            self.decoded += len(data)
+            if self.decoded > self.limit:
+                raise BodyTooLarge(f'corpo descomprimido acima de {self.limit} bytes')
+            if data:
+                return data
+
+    def complete(self):
+        return self.raw.complete() and self._zlib.eof
+
+def decode_body(headers, body):
+    """Aplica o Content-Encoding da requisição; None se a codificação não for suportada."""
+    encoding = headers.get('Content-Encoding', 'identity').strip().lower()
+    if encoding in ('', 'identity'):
+        return body
+    if encoding not in DecodedBody.WBITS:
+        return None
+    return DecodedBody(body, encoding)
+
+class SpooledField:
+    """String grande do JSON que foi gravada em disco durante o parsing."""
+    __slots__ = ('path', 'size', 'escaped')
+
+    def __init__(self, path, size, escaped):
+        self.path = path
+        self.size = size
+        self.escaped = escaped
+
+_JSON_ESCAPES = {b'"': b'"', b'\\': b'\\', b'/': b'/', b'b': b'\b', b'f': b'\f', b'n': b'\n', b'r': b'\r', b't': b'\t'}
+# texto sem escapes, um par de surrogates (\uD83D\uDE00), um \uXXXX ou um escape simples
+_JSON_STRING_TOKEN = re.compile(rb'[^\\]+|\\u[dD][89abAB][0-9a-fA-F]{2}\\u[dD][c-fC-F][0-9a-fA-F]{2}'
+                                rb'|\\u[0-9a-fA-F]{4}|\\["\\/bfnrt]')
+
+def unescape_json_file(src, dst, chunk_size=BODY_CHUNK_SIZE):
+    """Decodifica os escapes de uma string JSON gravada crua em `src` (sem as aspas) para `dst`.
+
+    Lê em blocos: a memória não depende do tamanho da string. Um escape perto do fim do bloco
+    espera o bloco seguinte (um par de surrogates tem 12 bytes). ValueError se houver escape inválido.
+    """
+    with open(src, 'rb') as f, open(dst, 'wb') as out:
+        carry = b''
+        while True:
+            chunk = f.read(chunk_size)
+            buf = carry + chunk
+            pos = 0
+            while pos < len(buf):
+                m = _JSON_STRING_TOKEN.match(buf, pos)
+                if m is None:
+                    break
+                token = m.group()
+                if token[0] != 0x5c:
+                    out.write(token)
+                elif chunk and len(buf) - pos < 12:
+                    break  # pode ser a primeira metade de um par de surrogates
+                elif token[1] == 0x75:  # \u
+                    out.write(json.loads(b'"' + token + b'"').encode('utf-8'))
+                else:
+                    out.write(_JSON_ESCAPES[token[1:]])
+                pos = m.end()
+            carry = buf[pos:]
+            if not chunk:
+                if carry:
+                    raise ValueError('escape JSON inválido')
+                return
+
+class SpooledJSON:
+    """Parser incremental: recebe o corpo em blocos e tira do documento as strings maiores
+    que `threshold`, gravando-as em `spool_dir`.
+
+    Em memória fica só o "esqueleto" do JSON, com um marcador no lugar de cada string grande;
+    finish() devolve o objeto com SpooledField nessas posições. Assim um snapshot base64 de
+    vários MB nunca é copiado inteiro para a memória.
+    """
+
+    _SPECIAL = re.compile(rb'["\\]')
+
+    def __init__(self, spool_dir=UPLOADS_DIR, threshold=SPOOL_FIELD_THRESHOLD):
+        self.spool_dir = Path(spool_dir)
+        self.threshold = threshold
+        self.fields = []
+        self._skeleton = bytearray()
+        self._token = secrets.token_hex(8)
+        self._in_string = False
+        self._pending_escape = False
+        self._str_start = 0
+        self._spool = None
+        self._spool_size = 0
+        self._spool_escaped = False
+
+    def _append_string(self, data, escaped=False):
+        self._spool_escaped = self._spool_escaped or escaped
+        if self._spool is not None:
+            self._spool.write(data)
+            self._spool_size += len(data)
+            return
+        self._skeleton += data
+        if len(self._skeleton) - self._str_start > self.threshold:
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+            name = f'{time.strftime("%Y%m%dT%H%M%S")}-{self._token}-{len(self.fields)}.txt'
+            self._spool = (self.spool_dir / name).open('wb')
+            self._spool.write(self._skeleton[self._str_start:])
+            self._spool_size = len(self._skeleton) - self._str_start
+            del self._skeleton[self._str_start:]
+
+    def _close_string(self):
+        self._in_string = False
+        if self._spool is not None:
+            self._spool.close()
+            self.fields.append(SpooledField(Path(self._spool.name), self._spool_size, self._spool_escaped))
+            self._skeleton += f'\\u0000{self._token}:{len(self.fields) - 1}'.encode('ascii')
+            self._spool = None
+        self._skeleton += b'"'
+
+    def feed(self, chunk):
+        i, n = 0, len(chunk)
+        if self._pending_escape and n:
+            self._append_string(chunk[:1], True)
+            self._pending_escape = False
+            i = 1
+        while i < n:
+            if not self._in_string:
+                j = chunk.find(b'"', i)
+                if j < 0:
+                    self._skeleton += chunk[i:]
+                    return
+                self._skeleton += chunk[i:j + 1]
+                self._in_string = True
+                self._spool_escaped = False
+                self._str_start = len(self._skeleton)
+                i = j + 1
+                continue
+            m = self._SPECIAL.search(chunk, i)
+            if m is None:
+                self._append_string(chunk[i:])
+                return
+            j = m.start()
+            if chunk[j] == 0x5c:  # barra invertida: o byte seguinte faz parte do escape
+                if j + 1 < n:
+                    self._append_string(chunk[i:j + 2], True)
+                    i = j + 2
+                else:
+                    self._append_string(chunk[i:j + 1], True)
+                    self._pending_escape = True
+                    i = n
+            else:
+                self._append_string(chunk[i:j])
+                self._close_string()
+                i = j + 1
+
+    def _restore(self, obj):
+        if isinstance(obj, dict):
+            return {k: self._restore(v) for k, v in obj.items()}
+        if isinstance(obj, list):
+            return [self._restore(v) for v in obj]
+        if isinstance(obj, str) and obj.startswith('\x00' + self._token):
+            return self.fields[int(obj.rsplit(':', 1)[1])]
+        return obj
+
+    def finish(self, ndjson=False):
+        """Devolve o documento; ValueError se o JSON for inválido ou estiver incompleto.
+
+        Com `ndjson=True` o corpo é um documento por linha e o resultado é a lista deles.
+        """
+        if self._in_string:
+            raise ValueError('JSON incompleto')
+        if ndjson:
+            # quebra de linha só aparece fora de strings, então dá para separar no esqueleto
+            data = [json_loads(line) for line in self._skeleton.splitlines() if line.strip()]
+        else:
+            data = json_loads(self._skeleton)
+        if not self.fields:
+            return data
+        data = self._restore(data)
+        for field in self.fields:
+            if field.escaped:
+                tmp = field.path.with_name(field.path.name + '.tmp')
+                try:
+                    unescape_json_file(field.path, tmp)
+                    os.replace(tmp, field.path)
+                finally:
+                    tmp.unlink(missing_ok=True)
+                field.size = field.path.stat().st_size
+        return data
+
+    def raw(self):
+        """O corpo exatamente como recebido, se nenhuma string foi para o disco; senão None."""
+        return None if self.fields else bytes(self._skeleton)
+
+    def discard(self):
+        if self._spool is not None:
+            self._spool.close()
+            self.fields.append(SpooledField(Path(self._spool.name), self._spool_size, False))
+            self._spool = None
+        for field in self.fields:
+            field.path.unlink(missing_ok=True)
+
+def parse_json_body(body, ndjson=False):
+    """Lê o corpo em blocos com SpooledJSON. Retorna (dados, parser) ou levanta ValueError."""
+    parser = SpooledJSON()
+    try:
+        while True:
+            chunk = body.read()
+            if not chunk:
+                break
+            parser.feed(chunk)
+        if not body.complete():
+            raise ValueError('corpo incompleto')
+        return parser.finish(ndjson), parser
+    except Exception:
+        parser.discard()
+        raise
+
+def read_json_body(body, ndjson=False):
+    """parse_json_body com as respostas de erro de /collect: (dados, parser, None) ou (None, None, erro)."""
+    try:
+        data, parser = parse_json_body(body, ndjson)
+    except BodyTooLarge:
+        return None, None, error_response(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'Decoded body too large')
+    except TimeoutError:
+        return None, None, error_response(HTTPStatus.REQUEST_TIMEOUT, 'Body not received in time')
+    except Exception:
+        return None, None, error_response(HTTPStatus.BAD_REQUEST, 'Invalid JSON')
+    return data, parser, None
+
+def materialize_spooled(obj):
+    """Troca cada SpooledField pela referência ao arquivo, relativa a LOG_DIR."""
+    if isinstance(obj, dict):
+        return {k: materialize_spooled(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [materialize_spooled(v) for v in obj]
+    if isinstance(obj, SpooledField):
+        return {'$file': obj.path.relative_to(LOG_DIR).as_posix(), 'size': obj.size}
+    return obj
+
+class BlobStore:
+    """Arquivos binários em BLOB_DIR, nomeados pelo SHA-256 do conteúdo.
+
+    Conteúdo repetido (ex.: o mesmo frame enviado de novo) é gravado uma única vez; o
+    registro no JSONL guarda só o hash e o tamanho.
+    """
+
+    def __init__(self, root=BLOB_DIR):
+        self.root = Path(root)
+
+    def path_for(self, digest):
+        return self.root / digest[:2] / digest
+
+    def put_chunks(self, chunks):
+        """Grava os blocos num arquivo temporário, calculando o hash; retorna (hash, tamanho)."""
+        tmp_dir = self.root / 'tmp'
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        h = hashlib.sha256()
+        size = 0
+        fd, tmp_name = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    h.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            digest = h.hexdigest()
+            final = self.path_for(digest)
+            try:
+                # já existe: o mtime é renovado para o gc (min_age) não apagar o blob antes de o
+                # registro novo que o referencia chegar ao log
+                os.utime(final)
+                exists = True
+            except FileNotFoundError:
+                exists = False
+            if exists:
+                os.unlink(tmp_name)
+            else:
+                final.parent.mkdir(exist_ok=True)
+                os.replace(tmp_name, final)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_name)
+            raise
+        return digest, size
+
+    def iter_blobs(self):
+        for sub in self.root.glob('??'):
+            for path in sub.iterdir():
+                if len(path.name) == 64:
+                    yield path.name, path
+
+    def gc(self, referenced, min_age=BLOB_GC_MIN_AGE):
+        """Apaga blobs que nenhum registro referencia. Blobs mais novos que `min_age`
+        segundos são mantidos (o registro correspondente pode ainda estar na fila do writer)."""
+        removed = freed = 0
+        cutoff = time.time() - min_age
+        for digest, path in self.iter_blobs():
+            if digest in referenced:
+                continue
+            st = path.stat()
+            if st.st_mtime > cutoff:
+                continue
+            path.unlink()
+            removed += 1
+            freed += st.st_size
+        return removed, freed
+
+def iter_base64_chunks(text_chunks):
+    """Decodifica base64 em blocos (a string pode vir de um arquivo gigante)."""
+    pending = b''
+    for chunk in text_chunks:
+        pending += chunk
+        cut = len(pending) - len(pending) % 4
+        if cut:
+            yield base64.b64decode(pending[:cut], validate=True)
+            pending = pending[cut:]
+    if pending:
+        yield base64.b64decode(pending, validate=True)
+
+def _read_chunks(path, size=BODY_CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+def store_image_blob(payload):
+    """Troca payload['image_base64'] (data URL) por payload['image_blob'] no BLOB_STORE.
+
+    Se o conteúdo não for base64 válido o campo original é mantido. Retorna True se o
+    payload foi alterado.
+    """
+    value = payload.get('image_base64') if isinstance(payload, dict) else None
+    if isinstance(value, SpooledField):
+        chunks = _read_chunks(value.path)
+        head = next(chunks, b'')
+        rest = chunks
+    elif isinstance(value, str):
+        head, rest = value.encode('ascii', 'replace'), ()
+    else:
+        return False
+    content_type = 'application/octet-stream'
+    if head.startswith(b'data:'):
+        prefix, sep, head = head.partition(b',')
+        if not sep:
+            return False
+        content_type = prefix[5:].split(b';', 1)[0].decode('ascii', 'replace') or content_type
+    try:
+        digest, size = BLOB_STORE.put_chunks(iter_base64_chunks(itertools.chain((head,), rest)))
+    except (binascii.Error, ValueError):
+        return False
+    del payload['image_base64']
+    payload['image_blob'] = {'sha256': digest, 'size': size, 'content_type': content_type}
+    if isinstance(value, SpooledField):
+        value.path.unlink(missing_ok=True)
+    return True
+
+BLOB_STORE = BlobStore()
+
+_BLOB_REF = re.compile(r'"sha256": ?"([0-9a-f]{64})"')
+
+def referenced_blobs(paths):
+    """Hashes de blob citados nos arquivos JSONL (ou segmentos comprimidos) informados."""
+    refs = set()
+    for path in paths:
+        with open_segment(path) as raw, io.TextIOWrapper(raw, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                refs.update(_BLOB_REF.findall(line))
+    return refs
+
+def gc_blobs(min_age=BLOB_GC_MIN_AGE):
+    refs = referenced_blobs(RECORD_WRITER.segments.files())
+    removed, freed = BLOB_STORE.gc(refs, min_age)
+    print(f'{len(refs)} blobs referenciados; {removed} removidos ({freed / 1024 / 1024:.1f} MB liberados)')
+    return removed
+
+def handle_post(path, headers, body, client_ip):
+    if path.partition('?')[0] == '/_profile' and client_ip in LOOPBACK_ADDRESSES:
+        return profile_request(path)
+    if path not in ('/collect', '/collect/batch'):
+        return error_response(HTTPStatus.NOT_FOUND, 'Not found')
+    if body.remaining > MAX_BODY_SIZE:
+        return error_response(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, 'Body too large')
+    body = decode_body(headers, body)
+    if body is None:
+        return error_response(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, 'Unsupported Content-Encoding')
+    if path == '/collect':
+        data, parser, error = read_json_body(body)
+        if error is not None:
+            return error
+        now = datetime.datetime.utcnow().isoformat() + 'Z'
+        # corpo intacto (sem strings no disco nem snapshot trocado por blob): vai para o log
+        # como chegou, sem serializar o payload de novo
+        raw = None if store_image_blob(data) else parser.raw()
+        line = record_line(now, client_ip, raw if raw is not None else json_dumps(materialize_spooled(data)))
+        if not RECORD_WRITER.submit(line):
+            parser.discard()
+            return error_response(HTTPStatus.SERVICE_UNAVAILABLE, 'Could not save record')
+        resp = {'status': 'ok', 'saved_to': str(RECORD_WRITER.path), 'timestamp': now}
+        resp = Response(200, json_dumps(resp), 'application/json; charset=utf-8')
+        resp.payload_type = METRICS.payload_label(data.get('type') if isinstance(data, dict) else None)
+        METRICS.count('demo_collect_events_total', (('type', resp.payload_type),))
+        return resp
+    return collect_batch(headers, body, client_ip)
+
+def collect_batch(headers, body, client_ip):
+    """POST /collect/batch: lista JSON (ou NDJSON) de eventos, gravados com um único submit.
+
+    Todos os eventos do lote recebem o mesmo received_at e vão juntos para o writer, então
+    ou o lote inteiro é gravado ou nenhum evento é.
+    """
+    events, parser, error = read_json_body(body, 'ndjson' in headers.get('Content-Type', ''))
+    if error is not None:
+        return error
+    if not isinstance(events, list) or not events:
+        parser.discard()
+        return error_response(HTTPStatus.BAD_REQUEST, 'Expected a non-empty array of events')
+    if len(events) > BATCH_MAX_EVENTS:
+        parser.discard()
+        return error_response(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f'At most {BATCH_MAX_EVENTS} events per batch')
+    now = datetime.datetime.utcnow().isoformat() + 'Z'
+    lines = []
+    for event in events:
+        store_image_blob(event)
+        lines.append(record_line(now, client_ip, json_dumps(materialize_spooled(event))))
+    if not RECORD_WRITER.submit(b''.join(lines)):
+        parser.discard()
+        return error_response(HTTPStatus.SERVICE_UNAVAILABLE, 'Could not save record')
+    for event in events:
+        label = METRICS.payload_label(event.get('type') if isinstance(event, dict) else None)
+        METRICS.count('demo_collect_events_total', (('type', label),))
+    resp = {'status': 'ok', 'saved': len(events), 'saved_to': str(RECORD_WRITER.path), 'timestamp': now}
+    resp = Response(200, json_dumps(resp), 'application/json; charset=utf-8')
+    resp.payload_type = 'batch'
+    return resp
+
+def keep_alive_header(served, timeout=KEEPALIVE_TIMEOUT):
+    return f'timeout={timeout}, max={max(KEEPALIVE_MAX_REQUESTS - served, 0)}'
+
 class LocalHandler(http.server.BaseHTTPRequestHandler):
     server_version = 'LocalDemoHTTP/1.0'
+    # HTTP/1.1: a conexão é reaproveitada (inclusive com pipelining) até o cliente pedir
+    # 'Connection: close', ficar ocioso por KEEPALIVE_TIMEOUT ou atingir KEEPALIVE_MAX_REQUESTS
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    # cabeçalhos e corpo saem em writes separados; sem TCP_NODELAY o Nagle + ACK atrasado
+    # segura a resposta seguinte da mesma conexão por ~40 ms
+    disable_nagle_algorithm = True
 
-    def _set_headers(self, status=200, content_type='text/html; charset=utf-8'):
-        self.send_response(status)
-        self.send_header('Content-Type', content_type)
-        self.send_header('Cache-Control', 'no-store, no-cache, must-revalidate')
-        self.end_headers()
+    def setup(self):
+        self.timeout = self.server.idle_timeout
+        super().setup()
+        self.rfile.close()
+        self.reader = DeadlineReader(self.connection, self.timeout)
+        self.rfile = io.BufferedReader(self.reader)
 
-    def do_GET(self):
-        if self.path in ('/', '/index.html'):
-            self._set_headers()
-            self.wfile.write(HTML_CONTENT.encode('utf-8'))
+    def handle_one_request(self):
+        # a espera pela próxima requisição usa o timeout ocioso; do primeiro byte em diante,
+        # linha de requisição e cabeçalhos têm HEADER_TIMEOUT para chegar
+        self.reader.set_deadline(None, None)
+        # entre requisições keep-alive a conexão fica marcada como ociosa: a parada a fecha na hora
+        if self.requests_served and not self.server.set_idle(self, True):
+            self.close_connection = True
             return
-        if self.path.startswith('/static/'):
-            local = Path('.' + self.path)
-            if local.exists() and local.is_file():
-                self._set_headers(200, 'application/octet-stream')
-                with local.open('rb') as f:
-                    self.wfile.write(f.read())
+        try:
+            if not self.rfile.peek(1):
+                self.close_connection = True
                 return
-        self.send_error(HTTPStatus.NOT_FOUND, 'Not found')
+        except OSError:
+            self.close_connection = True
+            return
+        finally:
+            self.server.set_idle(self, False)
+        self.reader.set_deadline('header', HEADER_TIMEOUT)
+        super().handle_one_request()
+
+    def parse_request(self):
+        rfile = self.rfile
+        self.rfile = HeaderLimit(rfile, MAX_HEADER_SIZE - len(self.raw_requestline))
+        try:
+            if not super().parse_request():
+                return False
+        finally:
+            self.rfile = rfile
+        error = framing_error(self.headers)
+        if error is not None:
+            self.close_connection = True
+            self._send(error, time.perf_counter())
+            return False
+        wait = RATE_LIMITER.check(self.client_address[0])
+        if wait:
+            reject('rate_limit')
+            self.close_connection = True
+            self._send(rate_limited_response(wait), time.perf_counter())
+            return False
+        return True
+
+    def handle(self):
+        self.requests_served = 0
+        self.idle = False
+        self.idle_since = 0
+        scheme = 'https' if isinstance(self.connection, ssl.SSLSocket) else 'http'
+        METRICS.connection(scheme, 1)
+        self.server.track(self, True)
+        try:
+            super().handle()
+        finally:
+            self.server.track(self, False)
+            METRICS.connection(scheme, -1)
+
+    def _send(self, resp, started, bytes_in=0):
+        self.requests_served += 1
+        if self.requests_served >= KEEPALIVE_MAX_REQUESTS or self.server.saturated() or self.server.draining:
+            # com conexões esperando na fila do pool, não segura a thread numa conexão ociosa
+            self.close_connection = True
+        # send_response_only: o log de acesso é feito abaixo, já com tamanho e duração
+        self.send_response_only(resp.status)
+        self.send_header('Server', self.version_string())
+        self.send_header('Date', self.date_time_string())
+        for name, value in resp.headers:
+            self.send_header(name, value)
+        if resp.has_body():
+            self.send_header('Content-Length', str(len(resp.body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        else:
+            self.send_header('Keep-Alive', keep_alive_header(self.requests_served, self.timeout))
+        self.end_headers()
+        bytes_out = len(resp.body) if resp.has_body() else 0
+        if isinstance(resp.body, FileBody):
+            resp.body.send(self.connection)
+        else:
+            self.wfile.write(resp.body)
+        elapsed = time.perf_counter() - started
+        METRICS.request(self.command, self.path, resp, elapsed, bytes_in, bytes_out)
+        ACCESS_LOG.record(self.client_address[0], self.requestline, self.path, resp.status.value, bytes_out, elapsed)
+
+    def log_request(self, code='-', size='-'):
+        # só respostas de send_error passam por aqui (as demais são registradas em _send)
+        ACCESS_LOG.record(self.client_address[0], self.requestline, getattr(self, 'path', ''), int(code), None)
+
+    def do_GET(self):
+        started = time.perf_counter()
+        if content_length(self.headers):
+            # corpo num GET não é lido: a conexão fecha em vez de interpretá-lo como requisição
+            self.close_connection = True
+        self._send(handle_get(self.path, self.headers, self.client_address[0]), started)
 
     def do_POST(self):
-        if self.path == '/collect':
-            content_length = int(self.headers.get('Content-Length', 0))
-            raw = self.rfile.read(content_length) if content_length > 0 else b''
+        started = time.perf_counter()
+        length = content_length(self.headers)  # já validado em parse_request (framing_error)
+        self.reader.set_deadline('body', body_deadline(length))
+        body = BodyReader(self.rfile.read, length)
+        resp = handle_post(self.path, self.headers, body, self.client_address[0])
+        if not body.complete():
+            # corpo não lido (erro ou rota inexistente): a conexão não pode ser reaproveitada
+            self.close_connection = True
+        self._send(resp, started, body.received)
+
+class AsyncHTTPServer:
+    """Servidor HTTP/1.1 sobre asyncio: um único event loop atende todas as conexões.
+
+    Usa as mesmas rotas do LocalHandler (handle_get/handle_post). Conexões acima de
+    `max_connections` recebem 503 imediatamente, mantendo memória e latência estáveis.
+    """
+
+    def __init__(self, host, port, ssl_context=None, max_connections=ASYNC_MAX_CONNECTIONS, reuse_port=False):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.max_connections = max_connections
+        self.reuse_port = reuse_port
+        self.active = 0
+        self.draining = False
+        self._idle = {}  # writer -> desde quando a conexão espera a próxima requisição keep-alive
+        self._server = None
+
+    async def start(self, sock=None):
+        """Abre a porta, ou passa a atender `sock` (socket de escuta herdado no reinício)."""
+        import asyncio
+        options = dict(ssl=self.ssl_context, limit=MAX_HEADER_SIZE,
+                       ssl_handshake_timeout=TLS_HANDSHAKE_TIMEOUT if self.ssl_context else None)
+        if sock is not None:
+            self._server = await asyncio.start_server(self._client, sock=sock, **options)
+        else:
+            self._server = await asyncio.start_server(
+                self._client, self.host, self.port, reuse_address=True, reuse_port=self.reuse_port or None,
+                backlog=LISTEN_BACKLOG, **options)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def listener(self):
+        return self._server.sockets[0]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def stop_accepting(self):
+        self.draining = True
+        self._server.close()
+
+    async def wait_drained(self, deadline):
+        """Fecha as conexões ociosas e espera as demais terminarem a requisição atual (até
+        `deadline`, em time.monotonic()). Retorna quantas conexões continuavam abertas."""
+        import asyncio
+        while self.active and time.monotonic() < deadline:
+            idle_before = time.monotonic() - SHUTDOWN_IDLE_GRACE
+            for writer, since in list(self._idle.items()):
+                if since <= idle_before:
+                    del self._idle[writer]
+                    writer.close()
+            await asyncio.sleep(0.05)
+        return self.active
+
+    async def _write(self, writer, resp, keep_alive, served=0):
+        import asyncio
+        head = [f'HTTP/1.1 {resp.status.value} {resp.status.phrase}',
+                f'Server: {LocalHandler.server_version}',
+                'Date: ' + email.utils.formatdate(usegmt=True)]
+        head += [f'{name}: {value}' for name, value in resp.headers]
+        if resp.has_body():
+            head.append(f'Content-Length: {len(resp.body)}')
+        if keep_alive:
+            head += ['Connection: keep-alive', 'Keep-Alive: ' + keep_alive_header(served)]
+        else:
+            head.append('Connection: close')
+        head = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1', 'strict')
+        if isinstance(resp.body, FileBody):
+            # loop.sendfile usa os.sendfile em transportes comuns e leituras em blocos sobre TLS
             try:
-                data = json.loads(raw.decode('utf-8'))
-            except Exception:
-                self.send_error(HTTPStatus.BAD_REQUEST, 'Invalid JSON')
-                return
-            now = datetime.datetime.utcnow().isoformat() + 'Z'
-            client_ip = self.client_address[0]
-            record = {'received_at': now, 'client_ip': client_ip, 'payload': data}
-            out_file = LOG_DIR / 'collected.jsonl'
+                writer.write(head)
+                await writer.drain()
+                if resp.body.length:
+                    await asyncio.get_running_loop().sendfile(
+                        writer.transport, resp.body.file, resp.body.offset, resp.body.length)
+            finally:
+                resp.body.close()
+            return
+        writer.write(head + resp.body)
+        await writer.drain()
+
+    async def _read_body(self, reader, length):
+        """Recebe o corpo em blocos, no event loop, e devolve um arquivo posicionado no início.
+
+        Até ASYNC_BODY_MEMORY bytes ficam na memória; acima disso os blocos vão para um arquivo
+        temporário (gravado no executor). Assim cada upload ocupa memória limitada, e nenhuma
+        thread do executor fica esperando a rede. Levanta asyncio.TimeoutError se o corpo não
+        chegar até body_deadline() e IncompleteReadError se o cliente desconectar.
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + body_deadline(length)
+        buffer, spool = bytearray(), None
+        remaining = length
+        try:
+            while remaining:
+                chunk = await asyncio.wait_for(reader.read(min(BODY_CHUNK_SIZE, remaining)), deadline - loop.time())
+                if not chunk:
+                    raise asyncio.IncompleteReadError(bytes(buffer), length)
+                remaining -= len(chunk)
+                if spool is None and len(buffer) + len(chunk) <= ASYNC_BODY_MEMORY:
+                    buffer += chunk
+                    continue
+                if spool is None:
+                    spool = await loop.run_in_executor(None, tempfile.TemporaryFile)
+                    chunk, buffer = bytes(buffer) + chunk, bytearray()
+                await loop.run_in_executor(None, spool.write, chunk)
+        except BaseException:
+            if spool is not None:
+                spool.close()
+            raise
+        if spool is None:
+            return io.BytesIO(buffer)
+        spool.seek(0)
+        return spool
+
+    async def _client(self, reader, writer):
+        import asyncio
+        if self.active >= self.max_connections:
             try:
-                with out_file.open('a', encoding='utf-8') as f:
-                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
-            except Exception as e:
-                print('Erro ao salvar:', e)
-                self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR, 'Could not save')
-                return
-            self._set_headers(200, 'application/json; charset=utf-8')
-            resp = {'status': 'ok', 'saved_to': str(out_file), 'timestamp': now}
-            self.wfile.write(json.dumps(resp).encode('utf-8'))
+                resp = error_response(HTTPStatus.SERVICE_UNAVAILABLE, 'Too many connections')
+                resp.headers.append(('Retry-After', str(POOL_RETRY_AFTER)))
+                await self._write(writer, resp, False)
+            except (ConnectionError, ssl.SSLError):
+                pass
+            writer.close()
             return
-        self.send_error(HTTPStatus.NOT_FOUND, 'Not found')
+        self.active += 1
+        scheme = 'https' if self.ssl_context else 'http'
+        METRICS.connection(scheme, 1)
+        TLS_STATS.record(writer.get_extra_info('ssl_object'))
+        loop = asyncio.get_running_loop()
+        served = 0
+        try:
+            while True:
+                # ocioso até o primeiro byte; daí em diante os cabeçalhos têm HEADER_TIMEOUT
+                if served:
+                    if self.draining:
+                        break
+                    self._idle[writer] = time.monotonic()
+                try:
+                    head = await asyncio.wait_for(reader.readexactly(1), KEEPALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                finally:
+                    self._idle.pop(writer, None)
+                try:
+                    head += await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), HEADER_TIMEOUT)
+                except asyncio.TimeoutError:
+                    reject('header_timeout')
+                    break
+                except asyncio.LimitOverrunError:
+                    reject('header_too_large')
+                    await self._write(writer, error_response(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, 'Headers too large'), False)
+                    break
+                except asyncio.IncompleteReadError:
+                    break
+                request_line, _, raw_headers = head.partition(b'\r\n')
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._write(writer, error_response(HTTPStatus.BAD_REQUEST, 'Bad request syntax'), False)
+                    break
+                started = time.perf_counter()
+                bytes_in = 0
+                try:
+                    headers = http.client.parse_headers(io.BytesIO(raw_headers))
+                except http.client.HTTPException:
+                    # mais que http.client._MAXHEADERS cabeçalhos: mesma resposta do LocalHandler
+                    reject('header_too_large')
+                    await self._write(writer, error_response(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, 'Too many headers'), False)
+                    break
+                conn_header = headers.get('Connection', '').lower()
+                keep_alive = (conn_header != 'close') if version == 'HTTP/1.1' else (conn_header == 'keep-alive')
+                client_ip = writer.get_extra_info('peername')[0]
+                resp = framing_error(headers)
+                wait = RATE_LIMITER.check(client_ip) if resp is None else 0
+                if wait:
+                    reject('rate_limit')
+                    resp = rate_limited_response(wait)
+                if resp is not None:
+                    # corpo não enquadrável ou não lido: a conexão fecha depois desta resposta
+                    await self._write(writer, resp, False)
+                    METRICS.request(method, path, resp, time.perf_counter() - started, 0, len(resp.body))
+                    ACCESS_LOG.record(client_ip, request_line.decode('latin-1'), path, resp.status.value, len(resp.body),
+                                      time.perf_counter() - started)
+                    break
+                if method == 'GET':
+                    resp = handle_get(path, headers, client_ip)
+                    if content_length(headers):
+                        keep_alive = False  # corpo num GET não é lido
+                elif method == 'POST':
+                    # o corpo chega aqui, no event loop (_read_body); só o parsing e a gravação,
+                    # com o corpo já recebido, vão para o executor. Assim um cliente lento não
+                    # segura uma thread do executor (poucas, compartilhadas por todas as conexões)
+                    length = content_length(headers)
+                    data = io.BytesIO()
+                    if length <= MAX_BODY_SIZE:
+                        if version == 'HTTP/1.1' and headers.get('Expect', '').lower() == '100-continue':
+                            # o cliente (ex.: curl) só manda o corpo depois desta resposta provisória
+                            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                        try:
+                            data = await self._read_body(reader, length)
+                        except asyncio.TimeoutError:
+                            reject('body_timeout')
+                            resp = error_response(HTTPStatus.REQUEST_TIMEOUT, 'Body not received in time')
+                        except asyncio.IncompleteReadError:
+                            break
+                    else:
+                        keep_alive = False  # handle_post responde 413 sem ler o corpo
+                    with data:
+                        if resp is None:
+                            body = BodyReader(data.read, length)
+                            resp = await loop.run_in_executor(None, handle_post, path, headers, body, client_ip)
+                            bytes_in = length
+                        else:
+                            keep_alive = False
+                else:
+                    resp = error_response(HTTPStatus.NOT_IMPLEMENTED, f'Unsupported method ({method!r})')
+                    keep_alive = False
+                served += 1
+                if served >= KEEPALIVE_MAX_REQUESTS or self.draining:
+                    keep_alive = False
+                bytes_out = len(resp.body) if resp.has_body() else 0
+                await self._write(writer, resp, keep_alive, served)
+                elapsed = time.perf_counter() - started
+                METRICS.request(method, path, resp, elapsed, bytes_in, bytes_out)
+                ACCESS_LOG.record(client_ip, request_line.decode('latin-1'), path, resp.status.value, bytes_out, elapsed)
+                if not keep_alive:
+                    break
+        except (ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            self.active -= 1
+            METRICS.connection(scheme, -1)
+            writer.close()
 
-def generate_self_signed(cert_path: Path, key_path: Path):
-    """Gera cert/key autofirmados usando cryptography (se disponível)."""
+def generate_self_signed(cert_path: Path, key_path: Path, key_type='rsa'):
+    """Gera cert/key autofirmados usando cryptography (se disponível).
+
+    key_type 'rsa' gera RSA-2048; 'ecdsa' gera ECDSA P-256, cujo handshake é bem mais barato.
+    """
     try:
         from cryptography import x509
         from cryptography.x509.oid import NameOID
         from cryptography.hazmat.primitives import hashes, serialization
-        from cryptography.hazmat.primitives.asymmetric import rsa
+        from cryptography.hazmat.primitives.asymmetric import ec, rsa
         from cryptography.hazmat.backends import default_backend
         import datetime as dt
 
-        key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+        if key_type == 'ecdsa':
+            key = ec.generate_private_key(ec.SECP256R1(), backend=default_backend())
+        else:
+            key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
         subject = issuer = x509.Name([
             x509.NameAttribute(NameOID.COUNTRY_NAME, u"BR"),
             x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, u"Local"),
@@ -703,59 +2936,1545 @@ def generate_self_signed(cert_path: Path, key_path: Path):
         cert = cert.add_extension(x509.SubjectAlternativeName([x509.DNSName(u"localhost"), x509.DNSName(u"127.0.0.1")]), critical=False)
         cert = cert.sign(key, hashes.SHA256(), default_backend())
 
-        with key_path.open('wb') as f:
-            f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption()))
-        with cert_path.open('wb') as f:
-            f.write(cert.public_bytes(serialization.Encoding.PEM))
+        # arquivo temporário + rename: um processo interrompido no meio nunca deixa um
+        # cert.pem/key.pem truncado, e o cert (gravado por último) marca o par como completo
+        for path, data in ((key_path, key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption())),
+                           (cert_path, cert.public_bytes(serialization.Encoding.PEM))):
+            tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
         return True
     except Exception as e:
         print('Não foi possível gerar certificado automaticamente (cryptography ausente ou erro):', e)
         return False
 
-def run_servers():
-    # HTTP
-    httpd = socketserver.ThreadingTCPServer((HOST, HTTP_PORT), LocalHandler)
-    httpd.allow_reuse_address = True
-    t_http = threading.Thread(target=httpd.serve_forever, daemon=True)
-    t_http.start()
-    print(f'HTTP disponível em http://{HOST}:{HTTP_PORT} (desenvolvimento)')
-
-    # tenta gerar certificado se ausente
-    if not CERT_FILE.exists() or not KEY_FILE.exists():
+def certificate_available():
+    return CERT_FILE.exists() and KEY_FILE.exists()
+
+def ensure_certificate(key_type=TLS_KEY_TYPE):
+    """Gera o certificado autofirmado se ainda não existir. Retorna True se cert/key existem."""
+    if not certificate_available():
         print('Certificado não encontrado. Tentando gerar auto-assinado (requer cryptography)...')
-        ok = generate_self_signed(CERT_FILE, KEY_FILE)
+        ok = generate_self_signed(CERT_FILE, KEY_FILE, key_type)
         if ok:
             print('Certificado auto-assinado gerado: cert.pem / key.pem')
         else:
             print('Certificado não criado automaticamente. HTTPS pode não iniciar.')
+    return certificate_available()
+
+def certificate_task(key_type=TLS_KEY_TYPE):
+    """Gera o certificado numa thread, para o HTTP não esperar a chave (RSA-2048 leva centenas de ms).
 
-    https_started = False
-    if CERT_FILE.exists() and KEY_FILE.exists():
+    Retorna um threading.Event que fica pronto quando cert/key existem ou a geração falhou
+    (confira com certificate_available()). Se os arquivos já existem, volta pronto.
+    """
+    done = threading.Event()
+    if certificate_available():
+        done.set()
+        return done
+
+    def generate():
         try:
-            httpd_tls = socketserver.ThreadingTCPServer((HOST, HTTPS_PORT), LocalHandler)
-            httpd_tls.allow_reuse_address = True
-            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-            context.load_cert_chain(certfile=str(CERT_FILE), keyfile=str(KEY_FILE))
-            httpd_tls.socket = context.wrap_socket(httpd_tls.socket, server_side=True)
-            t_https = threading.Thread(target=httpd_tls.serve_forever, daemon=True)
-            t_https.start()
-            https_started = True
-            print(f'HTTPS disponível em https://{HOST}:{HTTPS_PORT} (aceite exceção de certificado no navegador)')
-        except Exception as e:
-            print('Erro ao iniciar HTTPS:', e)
+            ensure_certificate(key_type)
+        finally:
+            done.set()
+
+    threading.Thread(target=generate, name='certificate', daemon=True).start()
+    return done
+
+class TLSStats:
+    """Contadores de handshakes TLS: completos vs. sessões retomadas (ticket/cache)."""
+
+    def __init__(self):
+        self.full = 0
+        self.resumed = 0
+        self.failed = 0
+        self.context = None
+        self._lock = threading.Lock()
+
+    def record(self, ssl_object):
+        if ssl_object is None:
+            return
+        with self._lock:
+            if ssl_object.session_reused:
+                self.resumed += 1
+            else:
+                self.full += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failed += 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = {'handshakes_full': self.full, 'handshakes_resumed': self.resumed,
+                     'handshakes_failed': self.failed}
+        if self.context is not None:
+            stats['session_cache'] = self.context.session_stats()
+        return stats
+
+TLS_STATS = TLSStats()
+
+def build_ssl_context():
+    """SSLContext do listener HTTPS: TLS 1.2+, só ECDHE com AEAD, ALPN http/1.1 e retomada de
+    sessão (tickets no TLS 1.3, cache de sessão no TLS 1.2).
+
+    Os grupos de troca de chaves ficam no padrão do OpenSSL (X25519 primeiro, depois P-256...):
+    fixar uma curva só (set_ecdh_curve) valeria também para o TLS 1.3 e forçaria um
+    HelloRetryRequest, uma ida e volta a mais, nos navegadores que mandam só X25519.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(TLS_CIPHERS)
+    context.options |= ssl.OP_CIPHER_SERVER_PREFERENCE | ssl.OP_SINGLE_ECDH_USE
+    context.options &= ~ssl.OP_NO_TICKET
+    context.num_tickets = TLS_SESSION_TICKETS
+    context.set_alpn_protocols(['http/1.1'])
+    context.load_cert_chain(certfile=str(CERT_FILE), keyfile=str(KEY_FILE))
+    TLS_STATS.context = context
+    return context
+
+class LocalServer(socketserver.ThreadingTCPServer):
+    """ThreadingTCPServer que faz o handshake TLS na thread da conexão, não no accept().
+
+    O socket de escuta é embrulhado com do_handshake_on_connect=False; assim um cliente
+    lento ou parado no handshake só ocupa a própria thread (até TLS_HANDSHAKE_TIMEOUT).
+    """
+    request_queue_size = LISTEN_BACKLOG
+    idle_timeout = KEEPALIVE_TIMEOUT
+    reuse_port = False
+    # a parada espera as requisições em drain(); uma thread presa além do prazo não segura o processo
+    daemon_threads = True
+    block_on_close = False
+    draining = False
+
+    def __init__(self, *args, **kwargs):
+        self.connections = set()    # LocalHandler atendendo uma conexão
+        self.open_connections = 0   # aceitas e ainda não fechadas (inclui fila do pool e handshake TLS)
+        self._connections_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def _count_connection(self, delta):
+        with self._connections_lock:
+            self.open_connections += delta
+
+    def process_request(self, request, client_address):
+        self._count_connection(1)
+        super().process_request(request, client_address)
+
+    def shutdown_request(self, request):
+        try:
+            super().shutdown_request(request)
+        finally:
+            self._count_connection(-1)
+
+    def track(self, handler, is_open):
+        with self._connections_lock:
+            if is_open:
+                self.connections.add(handler)
+            else:
+                self.connections.discard(handler)
+
+    def set_idle(self, handler, idle):
+        """Marca a conexão como ociosa (esperando a próxima requisição keep-alive) ou não.
+        Retorna False se o servidor está parando: a conexão deve ser fechada."""
+        with self._connections_lock:
+            handler.idle = idle and not self.draining
+            handler.idle_since = time.monotonic()
+            return not (idle and self.draining)
+
+    def stop_accepting(self):
+        self.draining = True
+        self.shutdown()  # encerra o serve_forever; o socket de escuta continua aberto até server_close
+
+    def wait_drained(self, deadline):
+        """Fecha as conexões ociosas e espera as demais terminarem a requisição atual (até
+        `deadline`, em time.monotonic()). Retorna quantas conexões continuavam abertas."""
+        while True:
+            with self._connections_lock:
+                idle_before = time.monotonic() - SHUTDOWN_IDLE_GRACE
+                for handler in self.connections:
+                    if handler.idle and handler.idle_since <= idle_before:
+                        handler.idle = False
+                        with contextlib.suppress(OSError):
+                            handler.connection.shutdown(socket.SHUT_RDWR)
+                pending = self.open_connections
+            if not pending or time.monotonic() >= deadline:
+                return pending
+            time.sleep(0.05)
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def saturated(self):
+        return False
 
-    if not https_started:
+    def finish_request(self, request, client_address):
+        if isinstance(request, ssl.SSLSocket):
+            request.settimeout(TLS_HANDSHAKE_TIMEOUT)
+            started = time.perf_counter()
+            try:
+                request.do_handshake()
+            except (OSError, ssl.SSLError):
+                TLS_STATS.record_failure()
+                return
+            METRICS.observe('demo_tls_handshake_seconds', (('resumed', str(request.session_reused).lower()),),
+                            time.perf_counter() - started)
+            TLS_STATS.record(request)
+        super().finish_request(request, client_address)
+
+    def handle_error(self, request, client_address):
+        # cliente que fecha a conexão no meio da resposta (ex.: depois de um 408/431) não é erro do servidor
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+WORKER_POOLS = []
+
+class PooledServer(LocalServer):
+    """LocalServer com um número fixo de threads e uma fila limitada de conexões aceitas.
+
+    Com a fila cheia a conexão é recusada na hora, sem ocupar thread: no HTTP recebe um 503
+    com Retry-After; no HTTPS é apenas fechada (responder exigiria o handshake no accept).
+    Threads, fila e recusas aparecem em /_status.
+    """
+    idle_timeout = POOL_IDLE_TIMEOUT
+
+    def __init__(self, server_address, handler_class, workers=POOL_WORKERS, queue_size=POOL_QUEUE_SIZE,
+                 bind_and_activate=True):
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self.workers = workers
+        self.pending = queue.Queue(queue_size)
+        self.busy = 0
+        self.served = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        busy = error_response(HTTPStatus.SERVICE_UNAVAILABLE, 'Server busy')
+        self._busy_response = (
+            f'HTTP/1.1 503 Service Unavailable\r\nContent-Type: {http.server.DEFAULT_ERROR_CONTENT_TYPE}\r\n'
+            f'Content-Length: {len(busy.body)}\r\nRetry-After: {POOL_RETRY_AFTER}\r\n'
+            'Connection: close\r\n\r\n').encode('latin-1') + busy.body
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+        WORKER_POOLS.append(self)
+
+    def saturated(self):
+        return not self.pending.empty()
+
+    def stats(self):
+        with self._lock:
+            return {'port': self.server_address[1], 'tls': isinstance(self.socket, ssl.SSLSocket),
+                    'workers': self.workers, 'busy': self.busy, 'queued': self.pending.qsize(),
+                    'queue_size': self.pending.maxsize, 'served': self.served, 'rejected': self.rejected}
+
+    def process_request(self, request, client_address):
+        self._count_connection(1)
+        try:
+            self.pending.put_nowait((request, client_address))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            self._reject(request)
+            self._count_connection(-1)
+
+    def _reject(self, request):
+        if not isinstance(request, ssl.SSLSocket):
+            request.setblocking(False)
+            try:
+                request.send(self._busy_response)
+                request.shutdown(socket.SHUT_WR)
+                # descarta o pedido já recebido: fechar com dados não lidos manda RST e o
+                # cliente pode perder o 503
+                for _ in range(16):
+                    if not request.recv(65536):
+                        break
+            except OSError:
+                pass
+        request.close()
+
+    def _worker(self):
+        while True:
+            request, client_address = self.pending.get()
+            with self._lock:
+                self.busy += 1
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._lock:
+                    self.busy -= 1
+                    self.served += 1
+
+def start_threading_server(host, port, ssl_context=None, pool_size=0, pool_queue=POOL_QUEUE_SIZE,
+                           reuse_port=False, sock=None):
+    """Cria um LocalServer com LocalHandler e o atende numa thread própria.
+
+    Com pool_size > 0 usa um PooledServer (threads fixas e fila limitada) em vez de uma thread
+    por conexão. reuse_port liga SO_REUSEPORT (vários processos na mesma porta, --workers).
+    `sock` é um socket de escuta já pronto (herdado no reinício), usado no lugar de host/port.
+    """
+    if pool_size > 0:
+        httpd = PooledServer((host, port), LocalHandler, pool_size, pool_queue, bind_and_activate=False)
+    else:
+        httpd = LocalServer((host, port), LocalHandler, bind_and_activate=False)
+    if sock is not None:
+        httpd.socket.close()
+        httpd.socket = sock
+        httpd.server_address = sock.getsockname()
+    else:
+        httpd.allow_reuse_address = True
+        httpd.reuse_port = reuse_port
+        try:
+            httpd.server_bind()
+            httpd.server_activate()
+        except BaseException:
+            httpd.server_close()
+            raise
+    if ssl_context is not None:
+        httpd.socket = ssl_context.wrap_socket(httpd.socket, server_side=True, do_handshake_on_connect=False)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+def run_servers(key_type=TLS_KEY_TYPE, pool_size=0, pool_queue=POOL_QUEUE_SIZE, reuse_port=False, announce=True,
+                ssl_context=None):
+    """Motores threading/pool. `ssl_context` já pronto (--workers) evita criar um por processo."""
+    say = print if announce else (lambda *args: None)
+    RECORD_WRITER.start()
+    # HTTP
+    httpd = start_threading_server(HOST, HTTP_PORT, None, pool_size, pool_queue, reuse_port,
+                                   LIFECYCLE.inherited('http'))
+    servers = {'http': httpd}
+    say(f'HTTP disponível em http://{HOST}:{HTTP_PORT} (desenvolvimento)')
+
+    https_sock = LIFECYCLE.inherited('https')  # lido agora: notify_ready limpa a variável
+
+    def start_https():
+        if certificate_available():
+            try:
+                servers['https'] = start_threading_server(HOST, HTTPS_PORT, ssl_context or build_ssl_context(), pool_size,
+                                                          pool_queue, reuse_port, https_sock)
+                say(f'HTTPS disponível em https://{HOST}:{HTTPS_PORT} (aceite exceção de certificado no navegador)')
+                return
+            except Exception as e:
+                print('Erro ao iniciar HTTPS:', e)
         print('HTTPS não iniciado. Use HTTP em http://127.0.0.1:8000')
 
     try:
+        # sem cert.pem, a chave é gerada em segundo plano e o HTTP já atende enquanto isso
+        certificate = certificate_task(key_type)
+        if certificate.is_set():
+            start_https()
+            certificate = None
+        LIFECYCLE.notify_ready()
+        say('\nPressione Ctrl+C para parar...')
+        while True:
+            if certificate is not None and certificate.wait(1):
+                start_https()
+                certificate = None
+            if (LIFECYCLE.restart.wait(1 if certificate is None else 0)
+                    and LIFECYCLE.handoff({name: srv.socket for name, srv in servers.items()})):
+                break
+    except KeyboardInterrupt:
+        say('\nParando servidores...')
+    for server in servers.values():
+        server.stop_accepting()
+    deadline = time.monotonic() + LIFECYCLE.drain_timeout
+    pending = sum(server.wait_drained(deadline) for server in servers.values())
+    if pending:
+        print(f'{pending} conexões ainda abertas após {LIFECYCLE.drain_timeout}s; encerrando mesmo assim')
+    RECORD_WRITER.close()
+    ACCESS_LOG.close()
+    for server in servers.values():
+        server.server_close()
+
+async def serve_async(max_connections=ASYNC_MAX_CONNECTIONS, key_type=TLS_KEY_TYPE, reuse_port=False,
+                      announce=True, ssl_context=None):
+    import asyncio
+    say = print if announce else (lambda *args: None)
+    loop = asyncio.get_running_loop()
+    if threading.current_thread() is threading.main_thread():
+        # SIGTERM/SIGINT cancelam só esta tarefa (não as conexões), que então faz a parada gradual;
+        # sinais repetidos durante a parada são ignorados
+        main_task = asyncio.current_task()
+        stopping = []
+
+        def stop():
+            if not stopping:
+                stopping.append(True)
+                main_task.cancel()
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stop)
+    RECORD_WRITER.start()
+    servers = {'http': AsyncHTTPServer(HOST, HTTP_PORT, max_connections=max_connections, reuse_port=reuse_port)}
+    await servers['http'].start(LIFECYCLE.inherited('http'))
+    say(f'HTTP disponível em http://{HOST}:{HTTP_PORT} (motor asyncio, até {max_connections} conexões)')
+
+    https_sock = LIFECYCLE.inherited('https')  # lido agora: notify_ready limpa a variável
+
+    async def start_https():
+        if await loop.run_in_executor(None, ensure_certificate, key_type):
+            try:
+                server_tls = AsyncHTTPServer(HOST, HTTPS_PORT, ssl_context or build_ssl_context(), max_connections,
+                                             reuse_port)
+                await server_tls.start(https_sock)
+                servers['https'] = server_tls
+                say(f'HTTPS disponível em https://{HOST}:{HTTPS_PORT} (aceite exceção de certificado no navegador)')
+                return
+            except Exception as e:
+                print('Erro ao iniciar HTTPS:', e)
+        print('HTTPS não iniciado. Use HTTP em http://127.0.0.1:8000')
+
+    # sem cert.pem, a chave é gerada em segundo plano e o HTTP já atende enquanto isso
+    https_task = None
+    if certificate_available():
+        await start_https()
+    else:
+        https_task = asyncio.create_task(start_https())
+    LIFECYCLE.notify_ready()
+
+    say('\nPressione Ctrl+C para parar...')
+    try:
+        while True:
+            await asyncio.sleep(0.5)
+            if LIFECYCLE.restart.is_set():
+                listeners = {name: server.listener() for name, server in servers.items()}
+                if await loop.run_in_executor(None, LIFECYCLE.handoff, listeners):
+                    break
+    except asyncio.CancelledError:
+        say('\nParando servidores...')
+    finally:
+        if https_task is not None and not https_task.done():
+            https_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await https_task
+        try:
+            for server in servers.values():
+                server.stop_accepting()
+            deadline = time.monotonic() + LIFECYCLE.drain_timeout
+            pending = 0
+            for server in servers.values():
+                pending += await server.wait_drained(deadline)
+            if pending:
+                print(f'{pending} conexões ainda abertas após {LIFECYCLE.drain_timeout}s; encerrando mesmo assim')
+        finally:
+            RECORD_WRITER.close()
+            ACCESS_LOG.close()
+
+def run_async_servers(max_connections=ASYNC_MAX_CONNECTIONS, key_type=TLS_KEY_TYPE, reuse_port=False, announce=True,
+                      ssl_context=None):
+    import asyncio
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(serve_async(max_connections, key_type, reuse_port, announce, ssl_context))
+
+class Lifecycle:
+    """Parada gradual e reinício sem perder conexões, para os dois motores.
+
+    Parar (SIGTERM/SIGINT): as portas deixam de aceitar conexões, as conexões ociosas são
+    fechadas e as ocupadas terminam a requisição atual (até `drain_timeout`); só então o
+    RecordWriter e o log de acesso gravam o que ainda está na fila.
+
+    Reiniciar (SIGHUP): um novo processo é iniciado com o mesmo comando, herdando os sockets
+    de escuta (LISTEN_FDS_ENV). Quando ele avisa que está atendendo (pipe em READY_FD_ENV),
+    este processo para como acima. As portas nunca ficam fechadas: conexões novas esperam no
+    backlog do socket compartilhado. Se o novo processo falhar, este continua atendendo.
+    """
+
+    def __init__(self, drain_timeout=SHUTDOWN_DRAIN_TIMEOUT):
+        self.drain_timeout = drain_timeout
+        self.argv = []
+        self.restart = threading.Event()
+
+    def request_restart(self, signum=None, frame=None):
+        self.restart.set()
+
+    def inherited(self, name):
+        """Socket de escuta `name` ('http'/'https') herdado do processo anterior, ou None."""
+        for item in os.environ.get(LISTEN_FDS_ENV, '').split(','):
+            key, _, fd = item.partition('=')
+            if key == name and fd:
+                sock = socket.socket(fileno=int(fd))
+                sock.setblocking(False)
+                return sock
+        return None
+
+    def notify_ready(self):
+        """Chamado com as portas abertas: avisa o processo anterior, se houver, que pode parar."""
+        os.environ.pop(LISTEN_FDS_ENV, None)
+        fd = os.environ.pop(READY_FD_ENV, None)
+        if fd:
+            with contextlib.suppress(OSError):
+                os.write(int(fd), b'1')
+                os.close(int(fd))
+
+    def handoff(self, listeners, timeout=HANDOFF_READY_TIMEOUT):
+        """Inicia o novo processo com os sockets de `listeners` ({nome: socket}).
+
+        Retorna True quando ele estiver atendendo; False se não iniciar ou não avisar em
+        `timeout` segundos (nesse caso ele é encerrado e este processo segue normalmente).
+        """
+        import subprocess
+        self.restart.clear()
+        for sock in listeners.values():
+            # os dois processos aceitam no mesmo socket durante a troca: quem perde a corrida
+            # recebe EAGAIN em vez de ficar bloqueado no accept() (o que travaria a parada)
+            sock.setblocking(False)
+        fds = {name: sock.fileno() for name, sock in listeners.items()}
+        ready_r, ready_w = os.pipe()
+        env = dict(os.environ)
+        env[LISTEN_FDS_ENV] = ','.join(f'{name}={fd}' for name, fd in fds.items())
+        env[READY_FD_ENV] = str(ready_w)
+        try:
+            child = subprocess.Popen([sys.executable, str(Path(__file__).resolve()), *self.argv],
+                                     pass_fds=[*fds.values(), ready_w], env=env)
+        except OSError as e:
+            print('Reinício falhou:', e)
+            os.close(ready_r)
+            return False
+        finally:
+            os.close(ready_w)
+        try:
+            ready = select.select([ready_r], [], [], timeout)[0] and os.read(ready_r, 1) == b'1'
+        finally:
+            os.close(ready_r)
+        if not ready:
+            print(f'Novo processo ({child.pid}) não ficou pronto em {timeout}s; mantendo este')
+            child.kill()
+            child.wait()
+            return False
+        print(f'Novo processo {child.pid} atendendo; parando o processo {os.getpid()}')
+        return True
+
+LIFECYCLE = Lifecycle()
+
+def _stop_worker(signum, frame):
+    # a primeira parada (Ctrl+C no terminal ou SIGTERM) interrompe o processo; as seguintes
+    # são ignoradas para não cortar a parada gradual nem o fechamento do RecordWriter
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+def run_prefork(workers, serve, stop_timeout=PREFORK_STOP_TIMEOUT):
+    """Supervisor do modo --workers: cria `workers` processos (fork) que executam serve().
+
+    Cada processo abre as próprias portas com SO_REUSEPORT (o kernel distribui as conexões)
+    e tem seu próprio RecordWriter; collected.jsonl é compartilhado via O_APPEND + flock.
+    Processos que morrem são recriados; Ctrl+C/SIGTERM para todos e espera cada um gravar
+    a fila de registros.
+    """
+    children = {}
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            signal.signal(signal.SIGINT, _stop_worker)
+            signal.signal(signal.SIGTERM, _stop_worker)
+            try:
+                serve()
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    signal.signal(signal.SIGTERM, _stop_worker)
+    try:
+        for _ in range(workers):
+            spawn()
+        print(f'{workers} workers atendendo HTTP :{HTTP_PORT} e HTTPS :{HTTPS_PORT} (SO_REUSEPORT)')
         print('\nPressione Ctrl+C para parar...')
         while True:
-            threading.Event().wait(1)
+            pid, status = os.wait()
+            started = children.pop(pid, None)
+            if started is None:
+                continue
+            reason = f'sinal {os.WTERMSIG(status)}' if os.WIFSIGNALED(status) else f'código {os.WEXITSTATUS(status)}'
+            print(f'Worker {pid} terminou ({reason}); reiniciando...')
+            if time.monotonic() - started < PREFORK_RESPAWN_DELAY:
+                time.sleep(PREFORK_RESPAWN_DELAY)  # evita um laço de forks se o worker morre ao iniciar
+            spawn()
     except KeyboardInterrupt:
-        print('\nParando servidores...')
-        httpd.shutdown()
-        if https_started and 'httpd_tls' in locals():
-            httpd_tls.shutdown()
+        print('\nParando workers...')
+    for pid in children:
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(pid, signal.SIGTERM)
+    deadline = time.monotonic() + stop_timeout
+    while children:
+        for pid in list(children):
+            done, _ = os.waitpid(pid, os.WNOHANG)
+            if done:
+                children.pop(pid)
+            elif time.monotonic() > deadline:
+                print(f'Worker {pid} não parou em {stop_timeout}s; encerrando à força')
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                children.pop(pid)
+        time.sleep(0.05)
+
+def parse_utc(value):
+    """ISO 8601 (com ou sem 'Z') -> timestamp UTC."""
+    ts = datetime.datetime.fromisoformat(value.strip().rstrip('Z'))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=datetime.timezone.utc)
+    return ts.timestamp()
+
+def skip_to(f, position, offset):
+    """Avança `f` de `position` até `offset` (streams zstd não aceitam seek)."""
+    if f.seekable():
+        f.seek(offset)
+        return
+    while position < offset:
+        data = f.read(min(offset - position, 1024 * 1024))
+        if not data:
+            break
+        position += len(data)
+
+class RecordIndex:
+    """Índice em disco (SQLite) dos registros de collected.jsonl e dos segmentos.
+
+    Guarda, por registro, received_at, client_ip, payload.type e a posição da linha no
+    segmento. Cada segmento é identificado pelo hash da sua primeira linha, que não muda
+    quando o arquivo ativo é rotacionado ou comprimido; a atualização continua do último
+    byte indexado de cada segmento. Um segmento fechado e indexado até o fim (o tamanho do
+    manifest) é marcado com o nome do arquivo (segment_file) e não é mais aberto: reabrir um
+    .gz só para chegar ao fim custaria descomprimi-lo inteiro a cada consulta.
+    """
+
+    # registros gravados pelo servidor quase sempre começam assim; evita json.loads da linha inteira
+    _PREFIX = re.compile(rb'\{"received_at":\s*"([^"]*)",\s*"client_ip":\s*"([^"]*)",\s*"payload":\s*'
+                         rb'\{\s*"type":\s*"((?:[^"\\]|\\.)*)"')
+
+    def __init__(self, path=INDEX_FILE, segments=None):
+        import sqlite3
+        self.path = Path(path)
+        self.segments = segments if segments is not None else RECORD_WRITER.segments
+        self.db = sqlite3.connect(str(self.path))
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS segments (
+                key TEXT PRIMARY KEY, seq INTEGER, path TEXT, offset INTEGER NOT NULL, segment_file TEXT);
+            CREATE TABLE IF NOT EXISTS records (
+                segment TEXT NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL,
+                received_at REAL, client_ip TEXT, type TEXT);
+            CREATE INDEX IF NOT EXISTS records_time ON records (received_at);
+            CREATE INDEX IF NOT EXISTS records_ip ON records (client_ip, received_at);
+            CREATE INDEX IF NOT EXISTS records_type ON records (type, received_at);
+        ''')
+        if 'segment_file' not in [row[1] for row in self.db.execute('PRAGMA table_info(segments)')]:
+            self.db.execute('ALTER TABLE segments ADD COLUMN segment_file TEXT')  # índice de versão anterior
+
+    def close(self):
+        self.db.close()
+
+    def _fields(self, line):
+        m = self._PREFIX.match(line)
+        if m is not None:
+            received_at, client_ip, type_ = (g.decode('utf-8', 'replace') if g is not None else None
+                                             for g in m.groups())
+            if type_ is not None and '\\' in type_:
+                type_ = json.loads(f'"{type_}"')
+        else:
+            # payload sem 'type' como primeira chave (ex.: corpo gravado como o cliente mandou)
+            try:
+                record = json_loads(line)
+                received_at, client_ip = record.get('received_at'), record.get('client_ip')
+                payload = record.get('payload')
+                type_ = payload.get('type') if isinstance(payload, dict) else None
+            except (ValueError, AttributeError):
+                return None
+        try:
+            ts = parse_utc(received_at) if received_at else None
+        except ValueError:
+            ts = None
+        return ts, client_ip, type_ if isinstance(type_, str) else None
+
+    def update(self):
+        """Indexa o que foi gravado desde a última atualização. Retorna o nº de registros novos."""
+        added = 0
+        complete = dict(self.db.execute('SELECT segment_file, key FROM segments WHERE segment_file IS NOT NULL'))
+        for seq, (path, entry) in enumerate(self.segments.entries()):
+            name = entry['file'].removesuffix('.gz').removesuffix('.zst') if entry is not None else None
+            if name in complete:
+                # só o caminho pode ter mudado (compressão terminou); o conteúdo já está indexado
+                self.db.execute('UPDATE segments SET seq = ?, path = ? WHERE key = ?', (seq, str(path), complete[name]))
+                continue
+            try:
+                f = open_segment(path)
+            except (OSError, RuntimeError) as e:
+                print(f'Ignorando {path}: {e}')
+                continue
+            with f:
+                first = f.readline()
+                if not first.endswith(b'\n'):
+                    continue
+                key = hashlib.sha1(first).hexdigest()
+                row = self.db.execute('SELECT offset FROM segments WHERE key = ?', (key,)).fetchone()
+                offset = row[0] if row else 0
+                if offset:
+                    skip_to(f, len(first), offset)
+                    lines = f
+                else:
+                    lines = itertools.chain((first,), f)
+                rows = []
+                for line in lines:
+                    if not line.endswith(b'\n'):
+                        break  # linha ainda sendo gravada
+                    fields = self._fields(line)
+                    if fields is not None:
+                        rows.append((key, offset, len(line)) + fields)
+                    offset += len(line)
+                done = entry is not None and offset == entry.get('bytes')
+                self.db.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)', rows)
+                self.db.execute('INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?, ?)',
+                                (key, seq, str(path), offset, name if done else None))
+                self.db.commit()
+                added += len(rows)
+        self.db.commit()
+        return added
+
+    @staticmethod
+    def _where(since=None, until=None, type_=None, client_ip=None, table=''):
+        clauses, params = [], []
+        if since is not None:
+            clauses.append(f'{table}received_at >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append(f'{table}received_at < ?')
+            params.append(until)
+        if type_ is not None:
+            clauses.append(f'{table}type = ?')
+            params.append(type_)
+        if client_ip is not None:
+            clauses.append(f'{table}client_ip = ?')
+            params.append(client_ip)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def count(self, **filters):
+        where, params = self._where(**filters)
+        return self.db.execute('SELECT COUNT(*) FROM records' + where, params).fetchone()[0]
+
+    def find(self, limit=None, **filters):
+        """Devolve as linhas (bytes) que atendem aos filtros, em ordem de gravação."""
+        where, params = self._where(table='r.', **filters)
+        sql = ('SELECT s.path, r.offset, r.length FROM records r JOIN segments s ON s.key = r.segment'
+               + where + ' ORDER BY s.seq, r.offset')
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+        current_path = f = None
+        try:
+            for path, offset, length in self.db.execute(sql, params):
+                if path != current_path:
+                    if f is not None:
+                        f.close()
+                    f, current_path, position = open_segment(path), path, 0
+                skip_to(f, position, offset)
+                yield f.read(length)
+                position = offset + length
+        finally:
+            if f is not None:
+                f.close()
+
+def query_records(args):
+    index = RecordIndex()
+    try:
+        if not args.no_update:
+            added = index.update()
+            if added:
+                print(f'{added} registros indexados', file=sys.stderr)
+        filters = {
+            'since': parse_utc(args.since) if args.since else None,
+            'until': parse_utc(args.until) if args.until else None,
+            'type_': args.type,
+            'client_ip': args.ip,
+        }
+        if args.count:
+            print(index.count(**filters))
+            return
+        out = sys.stdout.buffer
+        for line in index.find(limit=args.limit, **filters):
+            out.write(line)
+        out.flush()
+    finally:
+        index.close()
+
+def _put_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _get_varint(buf, pos):
+    result = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+def _read_varint(f):
+    result = shift = 0
+    while True:
+        b = f.read(1)
+        if not b:
+            raise EOFError('varint truncado')
+        result |= (b[0] & 0x7f) << shift
+        if b[0] < 0x80:
+            return result
+        shift += 7
+
+def _zigzag(n):
+    return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+def _unzigzag(z):
+    return z >> 1 if not z & 1 else -((z + 1) >> 1)
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+class CompactWriter:
+    """Grava registros no formato compacto (.crec): blocos colunares com strings internadas.
+
+    Arquivo: b'CREC\\x01' seguido de blocos. Cada bloco tem o nº de registros e cinco seções
+    (comprimidas com zlib e prefixadas pelo tamanho, para que uma leitura pule as que não
+    usa): strings novas do bloco, received_at (microssegundos, em deltas), client_ip e
+    payload.type (ids de string) e os payloads. Chaves e strings curtas (COMPACT_INTERN_MAX)
+    entram num dicionário único do arquivo e viram um id; os rótulos repetidos das tabelas
+    da página ("🌐 Navegador", ...) são gravados uma vez só por arquivo.
+    """
+
+    MAGIC = b'CREC\x01'
+    # tags dos valores do payload
+    NULL, FALSE, TRUE, INT, FLOAT, REF, STR, LIST, DICT = range(9)
+
+    def __init__(self, f, block_records=COMPACT_BLOCK_RECORDS, intern_max=COMPACT_INTERN_MAX):
+        self.f = f
+        self.block_records = block_records
+        self.intern_max = intern_max
+        self.records = 0
+        self._ids = {}
+        self._new = []
+        self._block = []
+        self._prev_ts = 0
+        f.write(self.MAGIC)
+
+    def _sid(self, value):
+        sid = self._ids.get(value)
+        if sid is None:
+            sid = self._ids[value] = len(self._ids)
+            self._new.append(value)
+        return sid
+
+    def _encode(self, out, value):
+        if value is None:
+            out.append(self.NULL)
+        elif value is True:
+            out.append(self.TRUE)
+        elif value is False:
+            out.append(self.FALSE)
+        elif isinstance(value, int):
+            out.append(self.INT)
+            _put_varint(out, _zigzag(value))
+        elif isinstance(value, float):
+            out.append(self.FLOAT)
+            out += struct.pack('<d', value)
+        elif isinstance(value, str):
+            if len(value) <= self.intern_max:
+                out.append(self.REF)
+                _put_varint(out, self._sid(value))
+            else:
+                data = value.encode('utf-8', 'surrogatepass')
+                out.append(self.STR)
+                _put_varint(out, len(data))
+                out += data
+        elif isinstance(value, list):
+            out.append(self.LIST)
+            _put_varint(out, len(value))
+            for item in value:
+                self._encode(out, item)
+        elif isinstance(value, dict):
+            out.append(self.DICT)
+            _put_varint(out, len(value))
+            for key, item in value.items():
+                _put_varint(out, self._sid(key))
+                self._encode(out, item)
+        else:
+            raise TypeError(f'valor não suportado: {type(value).__name__}')
+
+    def add(self, received_at, client_ip, payload):
+        self._block.append((received_at, client_ip, payload))
+        self.records += 1
+        if len(self._block) >= self.block_records:
+            self._flush_block()
+
+    def add_line(self, line):
+        record = json_loads(line)
+        self.add(record.get('received_at'), record.get('client_ip'), record.get('payload'))
+
+    def _flush_block(self):
+        ts_col, ip_col, type_col, payload_col = bytearray(), bytearray(), bytearray(), bytearray()
+        for received_at, client_ip, payload in self._block:
+            try:
+                micros = (datetime.datetime.fromisoformat(received_at.rstrip('Z')) - _EPOCH) // datetime.timedelta(microseconds=1) + 1
+            except (AttributeError, TypeError, ValueError):
+                micros = 0  # sem received_at (ou inválido)
+            _put_varint(ts_col, _zigzag(micros - self._prev_ts))
+            self._prev_ts = micros
+            _put_varint(ip_col, self._sid(client_ip) + 1 if isinstance(client_ip, str) else 0)
+            type_ = payload.get('type') if isinstance(payload, dict) else None
+            _put_varint(type_col, self._sid(type_) + 1 if isinstance(type_, str) else 0)
+            self._encode(payload_col, payload)
+        strings = bytearray()
+        _put_varint(strings, len(self._new))
+        for value in self._new:
+            data = value.encode('utf-8', 'surrogatepass')
+            _put_varint(strings, len(data))
+            strings += data
+        out = bytearray(b'B')
+        _put_varint(out, len(self._block))
+        for section in (strings, ts_col, ip_col, type_col, payload_col):
+            data = zlib.compress(bytes(section), 6)
+            _put_varint(out, len(data))
+            out += data
+        self.f.write(out)
+        self._block, self._new = [], []
+
+    def close(self):
+        if self._block:
+            self._flush_block()
+        self.f.flush()
+
+class CompactReader:
+    """Lê arquivos .crec. scan() decodifica só as colunas pedidas (payload é a mais cara);
+    records() devolve registros completos, no mesmo formato das linhas de collected.jsonl."""
+
+    SECTIONS = ('strings', 'received_at', 'client_ip', 'type', 'payload')
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def _blocks(self, columns):
+        strings = []
+        with self.path.open('rb') as f:
+            if f.read(len(CompactWriter.MAGIC)) != CompactWriter.MAGIC:
+                raise ValueError(f'{self.path}: não é um arquivo .crec')
+            while True:
+                tag = f.read(1)
+                if not tag:
+                    return
+                if tag != b'B':
+                    raise ValueError(f'{self.path}: bloco inválido')
+                n = _read_varint(f)
+                sections = {}
+                for name in self.SECTIONS:
+                    size = _read_varint(f)
+                    if name == 'strings' or name in columns:
+                        sections[name] = zlib.decompress(f.read(size))
+                    else:
+                        f.seek(size, 1)
+                data, pos = sections['strings'], 0
+                count, pos = _get_varint(data, pos)
+                for _ in range(count):
+                    size, pos = _get_varint(data, pos)
+                    strings.append(data[pos:pos + size].decode('utf-8', 'surrogatepass'))
+                    pos += size
+                yield n, strings, sections
+
+    def _decode(self, buf, pos, strings):
+        tag = buf[pos]
+        pos += 1
+        if tag == CompactWriter.REF:
+            sid, pos = _get_varint(buf, pos)
+            return strings[sid], pos
+        if tag == CompactWriter.DICT:
+            n, pos = _get_varint(buf, pos)
+            obj = {}
+            for _ in range(n):
+                sid, pos = _get_varint(buf, pos)
+                obj[strings[sid]], pos = self._decode(buf, pos, strings)
+            return obj, pos
+        if tag == CompactWriter.LIST:
+            n, pos = _get_varint(buf, pos)
+            items = []
+            for _ in range(n):
+                item, pos = self._decode(buf, pos, strings)
+                items.append(item)
+            return items, pos
+        if tag == CompactWriter.INT:
+            z, pos = _get_varint(buf, pos)
+            return _unzigzag(z), pos
+        if tag == CompactWriter.FLOAT:
+            return struct.unpack_from('<d', buf, pos)[0], pos + 8
+        if tag == CompactWriter.STR:
+            size, pos = _get_varint(buf, pos)
+            return buf[pos:pos + size].decode('utf-8', 'surrogatepass'), pos + size
+        return {CompactWriter.NULL: None, CompactWriter.TRUE: True, CompactWriter.FALSE: False}[tag], pos
+
+    def scan(self, columns=('received_at', 'client_ip', 'type')):
+        """Gera uma tupla por registro com as colunas pedidas (received_at como timestamp UTC)."""
+        prev_ts = 0
+        for n, strings, sections in self._blocks(columns):
+            ts_pos = ip_pos = type_pos = payload_pos = 0
+            for _ in range(n):
+                row = []
+                for name in columns:
+                    if name == 'received_at':
+                        z, ts_pos = _get_varint(sections[name], ts_pos)
+                        prev_ts += _unzigzag(z)
+                        row.append((prev_ts - 1) / 1e6 if prev_ts else None)
+                    elif name == 'client_ip':
+                        sid, ip_pos = _get_varint(sections[name], ip_pos)
+                        row.append(strings[sid - 1] if sid else None)
+                    elif name == 'type':
+                        sid, type_pos = _get_varint(sections[name], type_pos)
+                        row.append(strings[sid - 1] if sid else None)
+                    else:
+                        value, payload_pos = self._decode(sections['payload'], payload_pos, strings)
+                        row.append(value)
+                yield tuple(row)
+
+    def records(self):
+        for ts, client_ip, payload in self.scan(('received_at', 'client_ip', 'payload')):
+            received_at = (_EPOCH + datetime.timedelta(microseconds=round(ts * 1e6))).isoformat() + 'Z' if ts is not None else None
+            yield {'received_at': received_at, 'client_ip': client_ip, 'payload': payload}
+
+def compact_segment(src, dst):
+    """Converte um segmento JSONL (ativo, .gz ou .zst) para .crec. Retorna o nº de registros."""
+    dst = Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + '.tmp')
+    with open_segment(src) as f, tmp.open('wb') as out:
+        writer = CompactWriter(out)
+        for line in f:
+            if line.strip():
+                writer.add_line(line)
+        writer.close()
+    os.replace(tmp, dst)
+    return writer.records
+
+def compact_records(args):
+    """Comando compact: converte os segmentos para COMPACT_DIR, agrega ou exporta .crec."""
+    if args.to_jsonl:
+        out = sys.stdout.buffer
+        for record in CompactReader(args.to_jsonl).records():
+            out.write(record_line(record['received_at'], record['client_ip'], json_dumps(record['payload'])))
+        out.flush()
+        return
+    if args.count_by:
+        column = {'day': 'received_at', 'ip': 'client_ip', 'type': 'type'}[args.count_by]
+        counts = collections.Counter()
+        for path in sorted(COMPACT_DIR.glob('*.crec')):
+            for (value,) in CompactReader(path).scan((column,)):
+                if column == 'received_at' and value is not None:
+                    value = utc_iso(value)[:10]
+                counts[value] += 1
+        for value, n in counts.most_common():
+            print(f'{n}\t{value}')
+        return
+    segments = RECORD_WRITER.segments
+    for src in segments.files():
+        if src == segments.active_path and not args.include_active:
+            continue
+        dst = COMPACT_DIR / (src.name.split('.jsonl')[0] + '.crec')
+        if dst.exists() and dst.stat().st_mtime >= src.stat().st_mtime and src != segments.active_path:
+            continue
+        n = compact_segment(src, dst)
+        print(f'{src.name}: {n} registros, {src.stat().st_size} -> {dst.stat().st_size} bytes ({dst.name})')
+
+def bench_payloads(snapshot_bytes=BENCH_SNAPSHOT_BYTES):
+    """Corpos de /collect no formato enviado pela página (postToServer)."""
+    ua = 'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Mobile Safari/537.36'
+    now = '2025-10-06T12:00:00.000Z'
+    def grid(labels):
+        return [{'label': label, 'value': f'valor de exemplo para {label} ' * 2} for label in labels]
+    initial = {
+        'type': 'initial_snapshot', 'timestamp': now, 'ua': ua,
+        'uaHints': {'architecture': 'arm', 'model': 'Pixel 8', 'platform': 'Android', 'bitness': '64'},
+        'basic': grid(['🌐 Navegador', '💻 Sistema', '🔢 Plataforma/Arquitetura', '📱 Dispositivo', '📺 Resolução',
+                       '🖼️ Janela', '🎨 Cores', '🌍 Idioma', '⏰ Fuso Horário', '📅 Data/Hora']),
+        'fingerprint': grid(['🆔 User Agent', '🧾 UA Hints', '🖨️ Pixel Ratio', '📐 Orientação', '🧮 CPU Cores',
+                             '💾 Memória', '🔋 Bateria', '🎯 Canvas ID', '🔊 Audio Context', '📊 WebGL Info',
+                             '⏱️ TimeZone Offset']),
+        'network': grid(['🔒 Protocolo', '🌐 Host', '🔗 Porta', '📡 Conexão', '⚡ Download', '📶 RTT/Ping',
+                         '💰 Save Data', '🏠 Referrer', '🍪 Cookies', '🔍 Do Not Track']),
+        'hardware': grid(['📱 Touch', '📷 Câmera', '🎤 Microfone', '📍 GPS', '🎮 Gamepads', '💻 WebGL',
+                          '🔊 Web Audio', '📦 Storage', '🗄️ IndexedDB']),
+        'devices': [{'kind': k, 'label': 'sem-permissao', 'deviceId': secrets.token_hex(32)}
+                    for k in ('audioinput', 'videoinput', 'audiooutput')],
+    }
+    # bytes aleatórios: não comprimem, como um PNG real
+    image = 'data:image/png;base64,' + base64.b64encode(os.urandom(snapshot_bytes)).decode('ascii')
+    payloads = {
+        'initial_snapshot': initial,
+        'location': {'type': 'location', 'timestamp': now, 'latitude': -23.5505, 'longitude': -46.6333, 'accuracy': 12.5},
+        'camera_permission': {'type': 'camera_permission', 'timestamp': now, 'granted': True},
+        'microphone_permission': {'type': 'microphone_permission', 'timestamp': now, 'granted': False, 'error': 'Permission denied'},
+        'snapshot': {'type': 'snapshot', 'timestamp': now, 'image_base64': image},
+    }
+    return {name: json.dumps(body, ensure_ascii=False).encode('utf-8') for name, body in payloads.items()}
+
+# uma "visita" típica: a página, o snapshot inicial, permissões, localização e uma foto
+BENCH_MIX = (('GET', '/', None), ('POST', '/collect', 'initial_snapshot'), ('POST', '/collect', 'location'),
+             ('POST', '/collect', 'camera_permission'), ('POST', '/collect', 'microphone_permission'),
+             ('POST', '/collect', 'snapshot'))
+
+async def _bench_connection(host, port, ssl_context, requests, bodies, deadline, samples, errors):
+    import asyncio
+    reader = writer = None
+    i = 0
+    while time.monotonic() < deadline:
+        method, path, name = requests[i % len(requests)]
+        i += 1
+        body = bodies.get(name, b'')
+        route = name or path
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port, ssl=ssl_context)
+            head = (f'{method} {path} HTTP/1.1\r\nHost: {host}\r\nAccept-Encoding: gzip\r\n'
+                    f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n')
+            writer.write(head.encode('ascii') + body)
+            await writer.drain()
+            headers = http.client.parse_headers(io.BytesIO((await reader.readuntil(b'\r\n\r\n')).partition(b'\r\n')[2]))
+            status_ok = True
+            await reader.readexactly(int(headers.get('Content-Length', 0)))
+            if headers.get('Connection', '').lower() == 'close':
+                writer.close()
+                reader = writer = None
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ssl.SSLError, ValueError):
+            status_ok = False
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+        if status_ok:
+            samples.setdefault(route, []).append(time.perf_counter() - start)
+        else:
+            errors[route] = errors.get(route, 0) + 1
+    if writer is not None:
+        writer.close()
+
+def _bench_client(host, port, use_tls, concurrency, duration, snapshot_bytes, result_queue):
+    """Processo gerador de carga: `concurrency` conexões keep-alive num event loop."""
+    import asyncio
+    bodies = bench_payloads(snapshot_bytes)
+    ssl_context = ssl._create_unverified_context() if use_tls else None
+    samples, errors = {}, {}
+
+    async def run():
+        deadline = time.monotonic() + duration
+        # cada conexão começa num ponto diferente da visita, para misturar as rotas
+        mixes = [BENCH_MIX[k % len(BENCH_MIX):] + BENCH_MIX[:k % len(BENCH_MIX)] for k in range(concurrency)]
+        await asyncio.gather(*(_bench_connection(host, port, ssl_context, mix, bodies, deadline, samples, errors)
+                               for mix in mixes))
+    started = time.perf_counter()
+    asyncio.run(run())
+    result_queue.put({'elapsed': time.perf_counter() - started, 'samples': samples, 'errors': errors})
+
+def _percentiles(values):
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None}
+    values = sorted(values)
+    pick = lambda q: round(values[min(int(q * len(values)), len(values) - 1)] * 1000, 3)
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99)}
+
+def _rss_kb():
+    """(RSS atual, pico de RSS) do processo em KB, lidos de /proc quando disponível."""
+    try:
+        status = Path('/proc/self/status').read_text()
+        fields = dict(line.split(':', 1) for line in status.splitlines() if ':' in line)
+        return int(fields['VmRSS'].split()[0]), int(fields['VmHWM'].split()[0])
+    except (OSError, KeyError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return None, peak
+
+def bench_writer(records=20000, threads=8, record_bytes=512):
+    """Vazão do RecordWriter isolado (sem HTTP): registros/s e latência de submit."""
+    writer = RecordWriter(LOG_DIR / 'bench-writer.jsonl')
+    line = (json.dumps({'pad': 'x' * record_bytes}) + '\n').encode('utf-8')
+    latencies = []
+    def producer(n):
+        local = []
+        for _ in range(n):
+            t = time.perf_counter()
+            writer.submit(line)
+            local.append(time.perf_counter() - t)
+        latencies.extend(local)
+    started = time.perf_counter()
+    workers = [threading.Thread(target=producer, args=(records // threads,)) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    writer.close()
+    elapsed = time.perf_counter() - started
+    return {'records': len(latencies), 'threads': threads, 'records_per_s': round(len(latencies) / elapsed, 1),
+            'submit_latency_ms': _percentiles(latencies)}
+
+def bench_codec(seconds=0.5, names=('initial_snapshot', 'location')):
+    """Registros/s ao transformar um corpo de /collect na linha do log, para cada estratégia:
+    stdlib (json.loads + json.dumps do registro inteiro, o caminho antigo), o codec em uso
+    reserializando o payload e o codec só validando e usando o corpo como chegou."""
+    payloads = bench_payloads(1024)
+    now, ip = '2025-10-06T12:00:00.000000Z', '127.0.0.1'
+    strategies = {
+        'stdlib': lambda body: (json.dumps({'received_at': now, 'client_ip': ip, 'payload': json.loads(body.decode('utf-8'))},
+                                           ensure_ascii=False) + '\n').encode('utf-8'),
+        'reencode': lambda body: record_line(now, ip, json_dumps(json_loads(body))),
+        'splice': lambda body: (json_loads(body), record_line(now, ip, body))[1],
+    }
+    report = {'codec': JSON_CODEC, 'payloads': {}}
+    for name in names:
+        body = payloads[name]
+        rates = {}
+        for strategy, fn in strategies.items():
+            n, started = 0, time.perf_counter()
+            while time.perf_counter() - started < seconds:
+                for _ in range(50):
+                    fn(body)
+                n += 50
+            rates[strategy] = round(n / (time.perf_counter() - started), 1)
+        rates['speedup'] = round(rates['splice'] / rates['stdlib'], 2)
+        report['payloads'][name] = dict(bytes=len(body), records_per_s=rates)
+        print(f'codec {JSON_CODEC} {name} ({len(body)} B): stdlib {rates["stdlib"]}/s, '
+              f'reencode {rates["reencode"]}/s, splice {rates["splice"]}/s ({rates["speedup"]}x)', file=sys.stderr)
+    return report
+
+def run_benchmark(engine='threading', concurrency=(1, 8, 32), duration=5.0, schemes=('http', 'https'),
+                  snapshot_bytes=BENCH_SNAPSHOT_BYTES, access_log='off'):
+    """Sobe o servidor no loopback, neste processo, e mede cada nível de concorrência.
+
+    A carga vem de um processo separado (para não disputar o GIL com o servidor). Os dados
+    coletados durante o benchmark vão para um diretório temporário. O log de acesso fica
+    desligado, a menos que `access_log` peça um formato (para medir o custo dele).
+    """
+    import asyncio
+    import multiprocessing
+    access_log_format, ACCESS_LOG.format = ACCESS_LOG.format, access_log
+    ssl_context = build_ssl_context() if 'https' in schemes and ensure_certificate() else None
+    original_cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    os.chdir(workdir)  # LOG_DIR e demais caminhos são relativos: nada toca collected_data/ real
+    LOG_DIR.mkdir(exist_ok=True)
+    RECORD_WRITER.start()
+    servers, loop = {}, None
+    try:
+        for scheme in schemes:
+            ctx = ssl_context if scheme == 'https' else None
+            if scheme == 'https' and ctx is None:
+                print('HTTPS indisponível (sem certificado): pulando', file=sys.stderr)
+                continue
+            if engine == 'asyncio':
+                if loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, daemon=True).start()
+                server = AsyncHTTPServer('127.0.0.1', 0, ctx)
+                asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+                servers[scheme] = (server, server.port)
+            else:
+                server = start_threading_server('127.0.0.1', 0, ctx, POOL_WORKERS if engine == 'pool' else 0)
+                servers[scheme] = (server, server.server_address[1])
+
+        mp = multiprocessing.get_context('spawn')
+        results = []
+        for scheme, (_, port) in servers.items():
+            for level in concurrency:
+                result_queue = mp.Queue()
+                proc = mp.Process(target=_bench_client, args=('127.0.0.1', port, scheme == 'https', level,
+                                                              duration, snapshot_bytes, result_queue))
+                proc.start()
+                try:
+                    out = result_queue.get(timeout=duration + 60)
+                except queue.Empty:
+                    raise RuntimeError(f'gerador de carga não respondeu (exitcode {proc.exitcode})')
+                finally:
+                    proc.join(5)
+                total = sum(len(v) for v in out['samples'].values())
+                rss, rss_peak = _rss_kb()
+                results.append({
+                    'scheme': scheme, 'concurrency': level, 'requests': total,
+                    'errors': sum(out['errors'].values()),
+                    'rps': round(total / out['elapsed'], 1),
+                    'latency_ms': _percentiles([x for v in out['samples'].values() for x in v]),
+                    'routes': {route: dict(requests=len(v), **_percentiles(v)) for route, v in sorted(out['samples'].items())},
+                    'rss_kb': rss, 'rss_peak_kb': rss_peak,
+                })
+                print(f'{scheme} c={level}: {results[-1]["rps"]} req/s, p99 {results[-1]["latency_ms"]["p99"]} ms',
+                      file=sys.stderr)
+        return {
+            'meta': {'engine': engine, 'duration_s': duration, 'snapshot_bytes': snapshot_bytes,
+                     'access_log': access_log,
+                     'python': sys.version.split()[0], 'platform': sys.platform, 'cpus': os.cpu_count(),
+                     'started_at': utc_iso()},
+            'results': results,
+            'writer': bench_writer(),
+            'codec': bench_codec(),
+        }
+    finally:
+        for server, _ in servers.values():
+            if isinstance(server, AsyncHTTPServer):
+                asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+            else:
+                server.shutdown()
+                server.server_close()
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+        RECORD_WRITER.close()
+        ACCESS_LOG.close()
+        ACCESS_LOG.format = access_log_format
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def compare_benchmarks(old, new):
+    """Imprime a variação de req/s e p99 entre dois relatórios de benchmark."""
+    before = {(r['scheme'], r['concurrency']): r for r in old.get('results', [])}
+    for r in new['results']:
+        prev = before.get((r['scheme'], r['concurrency']))
+        if prev is None or not prev['rps']:
+            continue
+        rps = (r['rps'] - prev['rps']) / prev['rps'] * 100
+        p99_old, p99_new = prev['latency_ms']['p99'], r['latency_ms']['p99']
+        p99 = f'{(p99_new - p99_old) / p99_old * 100:+.1f}%' if p99_old and p99_new else 'n/a'
+        print(f'{r["scheme"]} c={r["concurrency"]}: req/s {rps:+.1f}%, p99 {p99}', file=sys.stderr)
+
+def _first_response(port, use_tls, deadline):
+    """True quando GET / responder 200 em `port`; False se não responder até `deadline`."""
+    context = ssl._create_unverified_context() if use_tls else None
+    while time.monotonic() < deadline:
+        timeout = max(deadline - time.monotonic(), 0.01)
+        if use_tls:
+            conn = http.client.HTTPSConnection('127.0.0.1', port, timeout=timeout, context=context)
+        else:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+        try:
+            conn.request('GET', '/')
+            if conn.getresponse().status == 200:
+                return True
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.01)
+        finally:
+            conn.close()
+    return False
+
+def _import_probe(workdir, env, timeout):
+    """Importa este arquivo num interpretador novo (sem SECRET_KEY no ambiente) e retorna
+    (ms da importação, módulos de STARTUP_LAZY_MODULES que ela carregou)."""
+    import subprocess
+    env = {k: v for k, v in env.items() if k not in ('SECRET_KEY', LISTEN_FDS_ENV)}
+    code = ('import json, sys, time\n'
+            f'sys.path.insert(0, {str(Path(__file__).resolve().parent)!r})\n'
+            'started = time.perf_counter()\n'
+            f'import {Path(__file__).stem}\n'
+            'elapsed = (time.perf_counter() - started) * 1000\n'
+            f'print(json.dumps([elapsed, [m for m in {STARTUP_LAZY_MODULES!r} if m in sys.modules]]))\n')
+    out = subprocess.run([sys.executable, '-c', code], cwd=workdir, env=env, capture_output=True,
+                         timeout=timeout, check=True).stdout
+    elapsed, loaded = json.loads(out)
+    return round(elapsed, 1), loaded
+
+def measure_startup(engine='threading', key_type=TLS_KEY_TYPE, runs=3, timeout=30.0, target=STARTUP_TARGET):
+    """Partida a frio: tempo do exec do interpretador até a primeira resposta em HTTP e em HTTPS.
+
+    Cada execução inicia este arquivo num diretório temporário vazio (sem cert.pem, então a
+    chave é gerada) com portas efêmeras no loopback, entregues como sockets herdados
+    (LISTEN_FDS_ENV, o mesmo caminho do reinício). As conexões esperam no backlog até o
+    servidor aceitar, então o tempo medido inclui importação, montagem da página e início
+    dos motores. Antes, _import_probe mede só a importação e confere que ela não carrega
+    nenhum módulo de STARTUP_LAZY_MODULES. O resultado passa se nenhum for carregado e a
+    mediana do HTTP ficar abaixo de `target` segundos.
+    """
+    import subprocess
+    results, eager_modules = [], set()
+    for _ in range(runs):
+        workdir = tempfile.mkdtemp(prefix='startup-')
+        listeners = {}
+        for name in ('http', 'https'):
+            sock = socket.create_server(('127.0.0.1', 0), backlog=LISTEN_BACKLOG)
+            sock.set_inheritable(True)
+            listeners[name] = sock
+        env = dict(os.environ)
+        env[LISTEN_FDS_ENV] = ','.join(f'{name}={sock.fileno()}' for name, sock in listeners.items())
+        env.pop(READY_FD_ENV, None)
+        import_ms, loaded = _import_probe(workdir, env, timeout)
+        eager_modules.update(loaded)
+        ports = {name: sock.getsockname()[1] for name, sock in listeners.items()}
+        started = time.monotonic()
+        child = subprocess.Popen([sys.executable, str(Path(__file__).resolve()), '--engine', engine,
+                                  '--cert-key', key_type, '--access-log-format', 'off'],
+                                 cwd=workdir, env=env, pass_fds=[s.fileno() for s in listeners.values()],
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for sock in listeners.values():
+            sock.close()
+        try:
+            run = {'import_ms': import_ms}
+            for name in ('http', 'https'):
+                ok = _first_response(ports[name], name == 'https', started + timeout)
+                run[f'{name}_ms'] = round((time.monotonic() - started) * 1000, 1) if ok else None
+            results.append(run)
+            print(f'import {import_ms} ms, http {run["http_ms"]} ms, https {run["https_ms"]} ms', file=sys.stderr)
+        finally:
+            child.terminate()
+            try:
+                child.wait(SHUTDOWN_DRAIN_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                child.kill()
+                child.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def median(key):
+        values = sorted(r[key] for r in results if r[key] is not None)
+        return values[len(values) // 2] if len(values) == len(results) else None
+
+    http_ms = median('http_ms')
+    return {
+        'meta': {'engine': engine, 'cert_key': key_type, 'runs': runs, 'target_ms': target * 1000,
+                 'python': sys.version.split()[0], 'platform': sys.platform, 'started_at': utc_iso()},
+        'runs': results,
+        'import_ms': median('import_ms'),
+        'eager_modules': sorted(eager_modules),
+        'http_ms': http_ms,
+        'https_ms': median('https_ms'),
+        'ok': not eager_modules and http_ms is not None and http_ms <= target * 1000,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Servidor local de demonstração (HTTP/HTTPS).')
+    parser.add_argument('--engine', choices=('threading', 'pool', 'asyncio'), default='threading',
+                        help='motor de serviço: uma thread por conexão (padrão), pool fixo de threads '
+                             'ou event loop asyncio')
+    parser.add_argument('--max-connections', type=int, default=ASYNC_MAX_CONNECTIONS,
+                        help='limite de conexões simultâneas por porta no motor asyncio')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processos servindo as mesmas portas (SO_REUSEPORT), com supervisor (padrão: 1)')
+    parser.add_argument('--pool-size', type=int, default=POOL_WORKERS,
+                        help='threads por porta no motor pool (padrão: %(default)s)')
+    parser.add_argument('--pool-queue', type=int, default=POOL_QUEUE_SIZE,
+                        help='conexões aceitas à espera de thread no motor pool (padrão: %(default)s)')
+    parser.add_argument('--fsync', choices=('none', 'batch', 'interval'), default=WRITER_FSYNC,
+                        help='quando sincronizar collected.jsonl com o disco (padrão: %(default)s)')
+    parser.add_argument('--cert-key', choices=('rsa', 'ecdsa'), default=TLS_KEY_TYPE,
+                        help='tipo de chave ao gerar o certificado autofirmado (padrão: %(default)s)')
+    parser.add_argument('--access-log-format', choices=AccessLog.FORMATS, default=ACCESS_LOG_FORMAT,
+                        help='formato do log de acesso, ou off (padrão: %(default)s)')
+    parser.add_argument('--access-log', metavar='ARQUIVO', default=ACCESS_LOG_FILE,
+                        help='grava o log de acesso neste arquivo (padrão: stderr)')
+    parser.add_argument('--access-log-sample', metavar='ROTA=FRAÇÃO,...', default='',
+                        help="registra só uma fração dos sucessos por rota, ex. '/static/=0.1'")
+    parser.add_argument('--rate-limit', type=float, default=RATE_LIMIT_RPS, metavar='RPS',
+                        help='requisições/s por IP, fora o loopback; 0 desliga (padrão: %(default)s)')
+    parser.add_argument('--rate-burst', type=int, default=RATE_LIMIT_BURST,
+                        help='rajada máxima por IP (padrão: %(default)s)')
+    parser.add_argument('--compress', choices=LogSegments.COMPRESSIONS, default=ROTATE_COMPRESSION,
+                        help='compressão dos segmentos fechados do log (padrão: %(default)s)')
+    commands = parser.add_subparsers(dest='command', metavar='comando')
+    gc_parser = commands.add_parser('gc-blobs', help='apaga snapshots (blobs) que nenhum registro referencia')
+    gc_parser.add_argument('--min-age', type=float, default=BLOB_GC_MIN_AGE,
+                           help='mantém blobs mais novos que N segundos (padrão: %(default)s)')
+    query_parser = commands.add_parser('query', help='consulta os registros coletados usando o índice em disco')
+    query_parser.add_argument('--since', help='received_at >= (ISO 8601, UTC)')
+    query_parser.add_argument('--until', help='received_at < (ISO 8601, UTC)')
+    query_parser.add_argument('--type', help='payload.type (initial_snapshot, location, snapshot, ...)')
+    query_parser.add_argument('--ip', help='client_ip')
+    query_parser.add_argument('--limit', type=int, help='no máximo N registros')
+    query_parser.add_argument('--count', action='store_true', help='mostra só a quantidade')
+    query_parser.add_argument('--no-update', action='store_true', help='não atualiza o índice antes da consulta')
+    compact_parser = commands.add_parser('compact', help='converte os segmentos para o formato compacto (.crec)')
+    compact_parser.add_argument('--include-active', action='store_true', help='converte também o arquivo ativo')
+    compact_parser.add_argument('--count-by', choices=('type', 'ip', 'day'),
+                                help='conta os registros dos .crec por coluna (sem decodificar os payloads)')
+    compact_parser.add_argument('--to-jsonl', metavar='ARQUIVO', help='exporta um .crec de volta para JSONL')
+    bench_parser = commands.add_parser('bench', help='benchmark do servidor no loopback (saída em JSON)')
+    bench_parser.add_argument('--engine', dest='bench_engine', choices=('threading', 'pool', 'asyncio'),
+                              default='threading')
+    bench_parser.add_argument('--concurrency', default='1,8,32', help='níveis de concorrência (padrão: %(default)s)')
+    bench_parser.add_argument('--duration', type=float, default=5.0, help='segundos por nível (padrão: %(default)s)')
+    bench_parser.add_argument('--schemes', default='http,https', help='http, https ou ambos (padrão: %(default)s)')
+    bench_parser.add_argument('--snapshot-kb', type=int, default=BENCH_SNAPSHOT_BYTES // 1024,
+                              help='tamanho da imagem do snapshot em KB (padrão: %(default)s)')
+    bench_parser.add_argument('--access-log-format', dest='bench_access_log', choices=AccessLog.FORMATS,
+                              default='off', help='log de acesso durante o benchmark (padrão: %(default)s)')
+    bench_parser.add_argument('--output', help='grava o relatório JSON neste arquivo (padrão: stdout)')
+    bench_parser.add_argument('--compare', help='relatório anterior para comparar')
+    startup_parser = commands.add_parser('startup-time', help='mede a partida a frio até a primeira resposta (saída em JSON)')
+    startup_parser.add_argument('--engine', dest='startup_engine', choices=('threading', 'pool', 'asyncio'),
+                                default='threading')
+    startup_parser.add_argument('--cert-key', dest='startup_cert_key', choices=('rsa', 'ecdsa'), default=TLS_KEY_TYPE)
+    startup_parser.add_argument('--runs', type=int, default=3, help='execuções; vale a mediana (padrão: %(default)s)')
+    startup_parser.add_argument('--target', type=float, default=STARTUP_TARGET,
+                                help='segundos até a primeira resposta HTTP; acima disso sai com código 1 '
+                                     '(padrão: %(default)s)')
+    args = parser.parse_args(argv)
+    if args.command == 'startup-time':
+        report = measure_startup(args.startup_engine, args.startup_cert_key, args.runs, target=args.target)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        if not report['ok']:
+            sys.exit(1)
+        return
+    if args.command == 'bench':
+        report = run_benchmark(args.bench_engine, [int(c) for c in args.concurrency.split(',')], args.duration,
+                               tuple(args.schemes.split(',')), args.snapshot_kb * 1024, args.bench_access_log)
+        text = json.dumps(report, indent=2, ensure_ascii=False)
+        if args.output:
+            Path(args.output).write_text(text + '\n', encoding='utf-8')
+        else:
+            print(text)
+        if args.compare:
+            compare_benchmarks(json.loads(Path(args.compare).read_text(encoding='utf-8')), report)
+        return
+    if args.command == 'gc-blobs':
+        gc_blobs(args.min_age)
+        return
+    if args.command == 'query':
+        query_records(args)
+        return
+    if args.command == 'compact':
+        compact_records(args)
+        return
+    RECORD_WRITER.fsync = args.fsync
+    LIFECYCLE.argv = list(sys.argv[1:] if argv is None else argv)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, PROFILER.toggle)  # kill -USR1 <pid> liga/desliga o perfil
+        if args.workers <= 1:
+            signal.signal(signal.SIGTERM, _stop_worker)
+            signal.signal(signal.SIGHUP, LIFECYCLE.request_restart)  # kill -HUP <pid>: reinício sem derrubar conexões
+    ACCESS_LOG.format = args.access_log_format
+    ACCESS_LOG.path = args.access_log
+    for item in filter(None, args.access_log_sample.split(',')):
+        route, _, rate = item.partition('=')
+        ACCESS_LOG.sample[route] = float(rate)
+    try:
+        RECORD_WRITER.segments.set_compression(args.compress)
+    except ValueError as e:
+        parser.error(str(e))
+    RATE_LIMITER.rate, RATE_LIMITER.burst = args.rate_limit, args.rate_burst
+    if args.workers > 1:
+        # antes do fork: os workers não disputam a geração do certificado e herdam o mesmo
+        # SSLContext, com as mesmas chaves de ticket. Uma sessão TLS retomada pode cair em
+        # qualquer worker do SO_REUSEPORT; com um contexto por processo, só 1/N retomaria
+        ssl_context = build_ssl_context() if ensure_certificate(args.cert_key) else None
+        if args.engine == 'asyncio':
+            serve = lambda: run_async_servers(args.max_connections, args.cert_key, reuse_port=True, announce=False,
+                                              ssl_context=ssl_context)
+        else:
+            pool_size = args.pool_size if args.engine == 'pool' else 0
+            serve = lambda: run_servers(args.cert_key, pool_size, args.pool_queue, reuse_port=True, announce=False,
+                                        ssl_context=ssl_context)
+        run_prefork(args.workers, serve)
+    elif args.engine == 'asyncio':
+        run_async_servers(args.max_connections, args.cert_key)
+    elif args.engine == 'pool':
+        run_servers(args.cert_key, args.pool_size, args.pool_queue)
+    else:
+        run_servers(args.cert_key)
 
 if __name__ == '__main__':
-    run_servers()
+    main()